@@ -1,17 +1,35 @@
-import requests
-from discord_webhook import DiscordWebhook
+import time
+# 起動時間の計測の起点（モジュールの読み込みを含む）
+PROCESS_STARTED = time.perf_counter()
+
 from datetime import datetime, timedelta
 import os
-import time
-import sys
+import argparse
 from dotenv import load_dotenv
 import logging
+import logging.handlers
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-import gc
+import socket
+from urllib.parse import urlsplit, parse_qs
+import threading
+import heapq
+import random
+import codecs
+import sqlite3
+import json
+import atexit
+from collections import deque, OrderedDict
+import bisect
+import hashlib
+import hmac
+import signal
+import tracemalloc
+import gzip
+import unicodedata
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # .envファイルの読み込み
 load_dotenv()
@@ -27,155 +45,1453 @@ WEBHOOK_URLS = {
 # 有効なWebhook URLを持つカテゴリのみを取得
 ACTIVE_CATEGORIES = {cat: url for cat, url in WEBHOOK_URLS.items() if url}
 
-# 環境変数の読み込み部分
-def load_player_list():
+# 名簿ファイル（JSON / CSV / テキスト、またはそれらを置いたディレクトリ）。未設定なら *_LIST の環境変数を使う
+ROSTER_PATH = os.getenv('ROSTER_PATH', '')
+# 名簿ファイルの更新を確認する間隔（秒）
+ROSTER_RELOAD_INTERVAL = float(os.getenv('ROSTER_RELOAD_INTERVAL', '30'))
+ROSTER_FILE_SUFFIXES = ('.json', '.csv', '.txt')
+# ライブページのURLで使う地域
+REGIONS = ('br', 'eune', 'euw', 'jp', 'kr', 'lan', 'las', 'me', 'na', 'oce', 'ph', 'ru', 'sg', 'th', 'tr', 'tw', 'vn')
+# 地域を書かないエントリの地域
+DEFAULT_REGION = os.getenv('DEFAULT_REGION', 'jp').lower()
+
+def normalize_riot_id(name):
+    """Riot ID（名前#タグ）の表記ゆれ（全角の＃、空白）をそろえ、形式が正しくなければ ValueError を送出する"""
+    name = unicodedata.normalize('NFC', name).replace('＃', '#')
+    game_name, separator, tag = name.rpartition('#')
+    game_name, tag = ' '.join(game_name.split()), tag.strip()
+    # 名前は3〜16文字、タグは3〜5文字の英数字
+    if not separator or not 3 <= len(game_name) <= 16 or not 3 <= len(tag) <= 5 or not tag.isalnum():
+        raise ValueError(f"Riot ID（名前#タグ）の形式ではありません: '{name}'")
+    return f"{game_name}#{tag}"
+
+def parse_player_entry(player_info):
+    """「ニックネーム:名前#タグ@地域」を (名前, ニックネーム, 地域) に分解する（ニックネームと地域は省略できる）"""
+    nickname, separator, name = player_info.rpartition(':')
+    name, at, region = name.partition('@')
+    nickname, name = nickname.strip(), name.strip()
+    region = region.strip().lower() if at else DEFAULT_REGION
+    if not name or ':' in nickname or (separator and not nickname):
+        raise ValueError(f"名簿の形式が正しくありません: '{player_info}'")
+    if region not in REGIONS:
+        raise ValueError(f"不明な地域です: '{player_info}'")
+    return normalize_riot_id(name), nickname or None, region
+
+def iter_env_roster():
+    """環境変数 *_LIST の名簿を (カテゴリ, エントリ, 出典) で返す"""
     categories = {
         'streamer': os.getenv('STREAMER_LIST', ''),
         'friend': os.getenv('FRIEND_LIST', ''),
         'smurf': os.getenv('SMURF_LIST', ''),
         'troll': os.getenv('TROLL_LIST', '')
     }
+    for category, player_list_str in categories.items():
+        for player_info in player_list_str.split(','):
+            yield category, player_info, f"{category.upper()}_LIST"
 
-    player_dict = {}
-    nickname_to_player = {}
-    player_categories = {}
+def iter_roster_file(path):
+    """名簿ファイルを (カテゴリ, エントリ, 出典) で返す
 
-    for category, player_list_str in categories.items():
-        # カテゴリが設定されていない場合はスキップ
-        if not player_list_str:
-            continue
+    カテゴリを書かない形式では、ファイル名（friend.txt など）をカテゴリとする。
+    - JSON: {"friend": ["ニックネーム:名前#タグ@地域", ...]} または
+            [{"name": "名前#タグ", "nickname": "...", "category": "friend", "region": "kr"}, ...]
+    - CSV: name, nickname, category, region の列（ヘッダー行が必要）
+    - テキスト: 1行に1エントリ（# で始まる行はコメント）
+    """
+    path = Path(path)
+    default_category = path.stem.lower()
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.suffix == '.json':
+            data = json.load(f)
+            if isinstance(data, dict):
+                for category, entries in data.items():
+                    for number, player_info in enumerate(entries, 1):
+                        yield category, player_info, f"{path.name} {category}[{number}]"
+            else:
+                for number, item in enumerate(data, 1):
+                    if isinstance(item, dict):
+                        name = str(item.get('name', ''))
+                        if item.get('region'):
+                            name = f"{name}@{item['region']}"
+                        player_info = f"{item['nickname']}:{name}" if item.get('nickname') else name
+                        category = item.get('category', default_category)
+                    else:
+                        player_info, category = item, default_category
+                    yield category, player_info, f"{path.name}[{number}]"
+        elif path.suffix == '.csv':
+            import csv
+            for number, row in enumerate(csv.DictReader(f), 2):
+                name = (row.get('name') or '').strip()
+                nickname = (row.get('nickname') or '').strip()
+                region = (row.get('region') or '').strip()
+                if region:
+                    name = f"{name}@{region}"
+                player_info = f"{nickname}:{name}" if nickname else name
+                yield (row.get('category') or default_category).strip(), player_info, f"{path.name}:{number}"
+        else:
+            for number, line in enumerate(f, 1):
+                if not line.lstrip().startswith('#'):
+                    yield default_category, line, f"{path.name}:{number}"
 
-        # このカテゴリのWebhook URLが設定されていない場合はスキップ
-        if category not in ACTIVE_CATEGORIES:
-            logging.info(f"カテゴリ '{category}' のWebhook URLが設定されていないため、プレイヤーをスキップします")
-            continue
+def roster_files(path):
+    path = Path(path)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix in ROSTER_FILE_SUFFIXES and p.is_file())
+    return [path]
 
-        for player_info in player_list_str.split(','):
-            player_info = player_info.strip()
+def load_player_list(roster_path=None):
+    """名簿を1回の走査で読み込み、{名前: (ニックネーム, カテゴリ, 地域)} を返す（不正なエントリは行ごとに除外）"""
+    roster_path = ROSTER_PATH if roster_path is None else roster_path
+    if roster_path:
+        sources = [iter_roster_file(path) for path in roster_files(roster_path)]
+    else:
+        sources = [iter_env_roster()]
+
+    roster = {}
+    skipped_categories = set()
+    for source in sources:
+        for category, player_info, origin in source:
+            player_info = str(player_info).strip()
             if not player_info:  # 空の要素はスキップ
                 continue
 
-            if ':' in player_info:
-                nickname, name = player_info.split(':')
-                player_dict[name] = nickname
-                nickname_to_player[nickname] = name
-            else:
-                # コロンがない場合は、ニックネームなしとして登録
-                name = player_info
-                player_dict[name] = None
+            # このカテゴリのWebhook URLが設定されていない場合はスキップ
+            category = str(category).lower()
+            if category not in ACTIVE_CATEGORIES:
+                if category not in skipped_categories:
+                    skipped_categories.add(category)
+                    logging.info(f"カテゴリ '{category}' のWebhook URLが設定されていないため、プレイヤーをスキップします")
+                continue
+
+            try:
+                name, nickname, region = parse_player_entry(player_info)
+            except ValueError as e:
+                logging.warning(f"{origin}: {e}")
+                continue
+            if name in roster:
+                logging.warning(f"{origin}: '{name}' が重複しているため、後のエントリを使用します")
+            roster[name] = (nickname, category, region)
+
+    return roster
+
+# グローバル変数として定義（main() の load_roster() で読み込む）
+PLAYER_DICT = {}
+NICKNAME_TO_PLAYER = {}
+PLAYER_CATEGORIES = {}
+PLAYERS_BY_CATEGORY = {}
+PLAYER_REGIONS = {}
+
+# ライブページのカード（data-summonername、小文字）から監視対象プレイヤーを引くための索引
+TRACKED_PLAYERS_BY_CARD = {}
+
+def apply_roster(roster):
+    """新しい名簿との差分だけをグローバルの索引に反映し、(追加, 削除) されたプレイヤーを返す"""
+    added = [name for name in roster if name not in PLAYER_DICT]
+    removed = [name for name in PLAYER_DICT if name not in roster]
+
+    for name in removed:
+        nickname = PLAYER_DICT.pop(name)
+        PLAYER_CATEGORIES.pop(name, None)
+        PLAYER_REGIONS.pop(name, None)
+        TRACKED_PLAYERS_BY_CARD.pop(name.lower(), None)
+        if nickname is not None and NICKNAME_TO_PLAYER.get(nickname) == name:
+            del NICKNAME_TO_PLAYER[nickname]
+    # 追加されたプレイヤーと、ニックネーム・カテゴリ・地域が変わったプレイヤーを更新する
+    for name, (nickname, category, region) in roster.items():
+        previous = PLAYER_DICT.get(name)
+        if (name in PLAYER_DICT and previous == nickname and PLAYER_CATEGORIES.get(name) == category
+                and PLAYER_REGIONS.get(name) == region):
+            continue
+        if previous is not None and NICKNAME_TO_PLAYER.get(previous) == name:
+            del NICKNAME_TO_PLAYER[previous]
+        PLAYER_DICT[name] = nickname
+        PLAYER_CATEGORIES[name] = category
+        PLAYER_REGIONS[name] = region
+        TRACKED_PLAYERS_BY_CARD[name.lower()] = name
+        if nickname is not None:
+            NICKNAME_TO_PLAYER[nickname] = name
+
+    players_by_category = {category: [] for category in ACTIVE_CATEGORIES}
+    for name, category in PLAYER_CATEGORIES.items():
+        players_by_category[category].append(name)
+    PLAYERS_BY_CATEGORY.clear()
+    PLAYERS_BY_CATEGORY.update(players_by_category)
+    return added, removed
+
+def load_roster():
+    """名簿を読み込んで検証し、グローバルの索引を更新する"""
+    # 環境変数の検証
+    if not ACTIVE_CATEGORIES:
+        raise ValueError("少なくとも1つのDiscord Webhook URLが設定されている必要があります。")
+
+    roster = load_player_list()
+    if not roster:
+        raise ValueError("有効なカテゴリに属するプレイヤーが1人も設定されていません。")
+    apply_roster(roster)
 
-            player_categories[name] = category
+    # 設定されたカテゴリごとにプレイヤーがいるかチェック
+    for category, players in PLAYERS_BY_CATEGORY.items():
+        if not players:
+            logging.warning(f"カテゴリ '{category}' にプレイヤーが設定されていません。")
 
-    return player_dict, nickname_to_player, player_categories
+class RosterWatcher:
+    """名簿ファイルの更新時刻を定期的に確認し、変更があれば差分だけを反映する"""
 
-# グローバル変数として定義
-PLAYER_DICT, NICKNAME_TO_PLAYER, PLAYER_CATEGORIES = load_player_list()
+    def __init__(self, path, interval=ROSTER_RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._signature = self._stat()
+        self._last_check = time.monotonic()
 
-# 環境変数の検証
-if not ACTIVE_CATEGORIES:
-    raise ValueError("少なくとも1つのDiscord Webhook URLが設定されている必要があります。")
+    def _stat(self):
+        try:
+            return tuple(
+                (str(path), stat.st_mtime_ns, stat.st_size)
+                for path in roster_files(self.path)
+                for stat in (path.stat(),)
+            )
+        except OSError:
+            return None
 
-if not PLAYER_DICT:
-    raise ValueError("有効なカテゴリに属するプレイヤーが1人も設定されていません。")
+    def poll(self, scheduler):
+        """変更があれば名簿を読み直し、スケジューラと状態に追加・削除を反映する"""
+        now = time.monotonic()
+        if now - self._last_check < self.interval:
+            return
+        self._last_check = now
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return
 
-# 設定されたカテゴリごとにプレイヤーがいるかチェック
-for category in ACTIVE_CATEGORIES.keys():
-    category_players = [name for name, cat in PLAYER_CATEGORIES.items() if cat == category]
-    if not category_players:
-        logging.warning(f"カテゴリ '{category}' にプレイヤーが設定されていません。")
+        try:
+            roster = load_player_list(self.path)
+        except (OSError, ValueError) as e:
+            # 書き込み途中などで読めない場合は、次の確認で再度読み込む
+            logging.error(f"名簿ファイルを読み込めませんでした: {str(e)}")
+            return
+        self._signature = signature
+        if not roster:
+            logging.error("名簿ファイルに有効なプレイヤーがいないため、現在の名簿を維持します")
+            return
 
-print("監視対象プレイヤー:")
-for player_name, nickname in PLAYER_DICT.items():
-    print(f"- {nickname} ({player_name})")
+        added, removed = apply_roster(roster)
+        for player_name in removed:
+            scheduler.remove(player_name)
+            forget_player(player_name)
+        # 追加されたプレイヤーが存在するかは並行して確認し、存在しなければ監視から外す
+        validating = ROSTER_VALIDATOR.submit(name for name in added if CLUSTER.owns(name))
+        for player_name in added:
+            # 確認中のプレイヤーは結果が出てから予定に入れる（確認の取得を1回目のチェックとして扱う）
+            if player_name in validating:
+                continue
+            # 追加されたプレイヤーは次のいくつかのスイープに分散してチェックする（担当分のみ）
+            if CLUSTER.owns(player_name) and not ROSTER_VALIDATOR.is_quarantined(player_name):
+                scheduler.add(player_name, random.uniform(0, SCHEDULE_ACTIVE_INTERVAL))
+        logging.info(f"名簿を再読み込みしました: 追加 {len(added)}人 / 削除 {len(removed)}人（合計 {len(PLAYER_DICT)}人）")
 
 # 定数の設定
-POROFESSOR_BASE_URL = "https://porofessor.gg/live/jp/"
+# porofessorのURL（オフラインのリプレイでは benchmarks/replay.py のサーバーを指定する）
+POROFESSOR_BASE_URL = os.getenv('POROFESSOR_BASE_URL', 'https://porofessor.gg').rstrip('/')
+# ライブページの取得元（カンマ区切り、先頭が通知に載せるリンクの取得元）。「種類」または「種類=ベースURL」で指定する
+# 例: porofessor,mock=http://127.0.0.1:8081
+LIVE_PROVIDERS = os.getenv('LIVE_PROVIDERS', 'porofessor')
+# 最初に問い合わせた取得元がこの秒数で応答しなければ、次の取得元にも並行して問い合わせる（0で無効）
+PROVIDER_HEDGE_DELAY = float(os.getenv('PROVIDER_HEDGE_DELAY', '2'))
+# 取得元ごとのレイテンシ・成功率の指数移動平均の重み
+PROVIDER_STATS_ALPHA = float(os.getenv('PROVIDER_STATS_ALPHA', '0.2'))
+# 順位の低い取得元の統計も更新するため、この割合のチェックでは1位と2位を入れ替える
+PROVIDER_EXPLORE_RATE = float(os.getenv('PROVIDER_EXPLORE_RATE', '0.05'))
 
 # プレイヤーごとの最大保存マッチ数を2に変更
 MAX_MATCHES_PER_PLAYER = 2
 
-# 最後のマッチ情報を保存する辞書
-last_match_info = {}
+# 並列ポーリングの設定（同時にチェックするプレイヤー数）
+POLL_WORKERS = max(1, int(os.getenv('POLL_WORKERS', '8')))
+# porofessor.gg へのリクエストレート（リクエスト/秒、0以下で無制限）とバースト上限
+POROFESSOR_RATE_LIMIT = float(os.getenv('POROFESSOR_RATE_LIMIT', '2'))
+POROFESSOR_RATE_BURST = max(1, int(os.getenv('POROFESSOR_RATE_BURST', '4')))
+# プレイヤー1人あたりのリクエストタイムアウト（秒）
+PLAYER_CHECK_TIMEOUT = float(os.getenv('PLAYER_CHECK_TIMEOUT', '10'))
+# HTTPクライアントの設定
+# 名前解決結果をキャッシュする時間（秒、0で無効）
+DNS_CACHE_TTL = float(os.getenv('DNS_CACHE_TTL', '300'))
+# httpx と h2 がインストールされている場合にHTTP/2を使う（0で無効）
+HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', '1') != '0'
+# ホストごとのサーキットブレーカー：連続失敗回数の閾値と、遮断を続ける時間（秒）
+CIRCUIT_FAILURE_THRESHOLD = max(1, int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5')))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '120'))
+# ストリーミング取得のチャンクサイズと、1ページあたりに読み込む上限（バイト）
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '16384'))
+STREAM_MAX_BYTES = int(os.getenv('STREAM_MAX_BYTES', str(2 * 1024 * 1024)))
+# ローディング中のページは、この秒数後にlive-partialを取得する（その間は他のプレイヤーのチェックを進める）
+PARTIAL_RETRY_DELAY = float(os.getenv('PARTIAL_RETRY_DELAY', '3'))
+# live-partialを取得する最大回数（まだ状態が分からない場合は同じ間隔で取得し直す）
+PARTIAL_MAX_ATTEMPTS = max(1, int(os.getenv('PARTIAL_MAX_ATTEMPTS', '3')))
 
-# ログの設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# 適応型スケジューラの設定（秒）
+# 1回のスイープでまとめてチェックする時間幅
+SCHEDULER_TICK = float(os.getenv('SCHEDULER_TICK', '10'))
+# オフラインのプレイヤーの基本間隔と、オフラインが続いた場合の上限
+SCHEDULE_BASE_INTERVAL = float(os.getenv('SCHEDULE_BASE_INTERVAL', '180'))
+SCHEDULE_MAX_INTERVAL = float(os.getenv('SCHEDULE_MAX_INTERVAL', '600'))
+# 試合終了直後（次の試合が始まりやすい時間帯）の間隔と、その時間帯の長さ
+SCHEDULE_ACTIVE_INTERVAL = float(os.getenv('SCHEDULE_ACTIVE_INTERVAL', '60'))
+SCHEDULE_ACTIVE_WINDOW = float(os.getenv('SCHEDULE_ACTIVE_WINDOW', '1800'))
+# 試合中のプレイヤーは最短試合時間が過ぎるまで再チェックしない
+SCHEDULE_MIN_GAME_LENGTH = float(os.getenv('SCHEDULE_MIN_GAME_LENGTH', '900'))
+SCHEDULE_IN_GAME_RECHECK = float(os.getenv('SCHEDULE_IN_GAME_RECHECK', '120'))
+# 存在しないプレイヤーの間隔（連続するたびに倍、最大3時間）
+SCHEDULE_NOT_FOUND_INTERVAL = float(os.getenv('SCHEDULE_NOT_FOUND_INTERVAL', '1800'))
+SCHEDULE_NOT_FOUND_MAX_INTERVAL = 10800
+# 直近の試合のうち、現在の時間帯（前後1時間）に始めた割合がこれ以上なら間隔を伸ばさない
+SCHEDULE_LIKELY_START_RATIO = float(os.getenv('SCHEDULE_LIKELY_START_RATIO', '0.25'))
+# マッチ情報を保持する時間（1.5時間）
+MATCH_RETENTION_SECONDS = 5400
+
+class MatchRecord:
+    """1人のプレイヤーが参加しているマッチの記録"""
+
+    __slots__ = ('match_id', 'player_name', 'champion', 'game_type', 'url', 'timestamp')
+
+    def __init__(self, match_id, player_name, champion, game_type, url, timestamp):
+        self.match_id = match_id
+        self.player_name = player_name
+        self.champion = champion
+        self.game_type = game_type
+        self.url = url
+        self.timestamp = timestamp
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class MatchIndex:
+    """マッチ → 参加プレイヤー、プレイヤー → 直近のマッチ の索引
+
+    重複の判定・同じマッチのプレイヤーの検索はO(1)で行い、古い記録は期限順のヒープから取り出して
+    削除するため、全件を走査するクリーンアップは不要。ワーカースレッドから更新されるためロックで保護する。
+    """
+
+    def __init__(self, retention=MATCH_RETENTION_SECONDS, max_per_player=MAX_MATCHES_PER_PLAYER):
+        self.retention = retention
+        self.max_per_player = max_per_player
+        self._lock = threading.Lock()
+        self._players_by_match = {}  # match_id -> {player_name}
+        self._matches_by_player = {}  # player_name -> [MatchRecord]（古い順、最大 max_per_player 件）
+        self._expiry = []  # (期限, 連番, MatchRecord)
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._matches_by_player)
+
+    def add(self, record):
+        """記録を追加する。同じプレイヤーの同じマッチが登録済みならFalse"""
+        with self._lock:
+            players = self._players_by_match.setdefault(record.match_id, set())
+            if record.player_name in players:
+                return False
+            players.add(record.player_name)
+            records = self._matches_by_player.setdefault(record.player_name, [])
+            records.append(record)
+            if len(records) > self.max_per_player:
+                self._unlink(records.pop(0))
+            self._sequence += 1
+            heapq.heappush(self._expiry, (record.timestamp + self.retention, self._sequence, record))
+            return True
+
+    def _unlink(self, record):
+        players = self._players_by_match.get(record.match_id)
+        if players is not None:
+            players.discard(record.player_name)
+            if not players:
+                del self._players_by_match[record.match_id]
+
+    def current(self, player_name):
+        """プレイヤーの直近のマッチ（なければNone）"""
+        with self._lock:
+            records = self._matches_by_player.get(player_name)
+            return records[-1] if records else None
+
+    def players_in(self, match_id):
+        """マッチに参加している記録済みのプレイヤー"""
+        with self._lock:
+            return set(self._players_by_match.get(match_id, ()))
+
+    def snapshot(self, player_name):
+        """保存用に、プレイヤーの記録を新しい順の辞書のリストで返す"""
+        with self._lock:
+            return [record.as_dict() for record in reversed(self._matches_by_player.get(player_name, ()))]
+
+    def restore(self, player_name, matches):
+        """保存済みの記録（snapshot の形式）を読み込む"""
+        now = time.time()
+        for match in sorted(matches, key=lambda m: m['timestamp']):
+            # 以前の形式はJSTの時差を加えた時刻のため、未来の時刻は現在時刻に丸める
+            timestamp = min(match['timestamp'], now)
+            self.add(MatchRecord(
+                match['match_id'], player_name, match.get('champion'),
+                match.get('game_type'), match.get('url'), timestamp
+            ))
+
+    def forget(self, player_name):
+        with self._lock:
+            for record in self._matches_by_player.pop(player_name, ()):
+                self._unlink(record)
+
+    def expire(self, now=None):
+        """期限を過ぎた記録を削除し、記録がなくなったプレイヤーの一覧を返す"""
+        now = time.time() if now is None else now
+        emptied = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, _, record = heapq.heappop(self._expiry)
+                records = self._matches_by_player.get(record.player_name)
+                # 件数の上限で既に外れた記録は、ヒープから捨てるだけ
+                if not records or record not in records:
+                    continue
+                records.remove(record)
+                self._unlink(record)
+                if not records:
+                    del self._matches_by_player[record.player_name]
+                    emptied.append(record.player_name)
+        return emptied
+
+# プレイヤーごとの直近のマッチ情報
+MATCH_INDEX = MatchIndex()
+
+# 試合終了時にDiscordへ通知するか
+MATCH_END_NOTIFY = os.getenv('MATCH_END_NOTIFY', 'false').lower() == 'true'
+# プレイヤーごとに統計に使う直近の試合数
+PLAYER_STATS_HISTORY = max(1, int(os.getenv('PLAYER_STATS_HISTORY', '100')))
+
+class MatchState:
+    """1試合の状態（loading → in_game → ended）と、検出した時刻"""
+
+    __slots__ = (
+        'match_id', 'state', 'first_seen', 'last_seen', 'ended_at', 'game_type', 'url', 'players', 'active'
+    )
+
+    def __init__(self, match_id, state, now, game_type, url):
+        self.match_id = match_id
+        self.state = state
+        self.first_seen = now
+        self.last_seen = now
+        self.ended_at = None
+        self.game_type = game_type
+        self.url = url
+        self.players = {}   # 参加していた監視対象のプレイヤー名 -> チャンピオン
+        self.active = set()  # まだ試合から離れたと確認できていないプレイヤー
+
+    def duration_range(self):
+        """試合時間の推定範囲（最後に試合中と確認した時刻まで 〜 終了を検出した時刻まで）"""
+        end = self.ended_at or self.last_seen
+        return self.last_seen - self.first_seen, end - self.first_seen
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['active'] = sorted(self.active)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        match = cls(data['match_id'], data['state'], data['first_seen'], data.get('game_type'), data.get('url'))
+        match.last_seen = data['last_seen']
+        match.ended_at = data.get('ended_at')
+        match.players = dict(data.get('players', {}))
+        match.active = set(data.get('active', ()))
+        return match
+
+class MatchLifecycle:
+    """進行中の試合を追跡し、参加していた監視対象が全員試合から離れたら終了とみなす"""
+
+    def __init__(self, retention=MATCH_RETENTION_SECONDS):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._matches = {}         # match_id -> MatchState（進行中のみ）
+        self._player_match = {}    # プレイヤー名 -> 参加中の match_id
+        self._ended = []           # 通知待ちの終了した試合
+        self._dirty = set()        # 前回の保存から変更（または削除）された match_id
+
+    def __len__(self):
+        return len(self._matches)
+
+    def observe(self, match_id, player_name, champion, game_type, url, loading=False):
+        """試合中（またはローディング中）のプレイヤーを記録する"""
+        now = time.time()
+        with self._lock:
+            previous = self._player_match.get(player_name)
+            if previous is not None and previous != match_id:
+                # 別の試合に移っていれば、前の試合からは離れている
+                self._leave(previous, player_name, now)
+            match = self._matches.get(match_id)
+            if match is None:
+                match = MatchState(match_id, 'loading' if loading else 'in_game', now, game_type, url)
+                self._matches[match_id] = match
+            else:
+                match.last_seen = now
+                if not loading:
+                    match.state = 'in_game'
+            match.players[player_name] = champion
+            match.active.add(player_name)
+            self._player_match[player_name] = match_id
+            self._dirty.add(match_id)
 
-# 起動時のログ
-logging.info("=== アプリケーション起動 ===")
-logging.info(f"起動時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-logging.info("監視対象プレイヤー:")
-for player_name, nickname in PLAYER_DICT.items():
-    logging.info(f"- {nickname} ({player_name})")
-logging.info("========================")
+    def player_left(self, player_name):
+        """プレイヤーが試合中でないと確認できたときに呼ぶ"""
+        with self._lock:
+            match_id = self._player_match.get(player_name)
+            if match_id is not None:
+                self._leave(match_id, player_name, time.time())
+
+    def _leave(self, match_id, player_name, now):
+        del self._player_match[player_name]
+        match = self._matches.get(match_id)
+        if match is None:
+            return
+        match.active.discard(player_name)
+        self._dirty.add(match_id)
+        # 他の監視対象がまだ試合中と確認できていない間は終了としない
+        if match.active:
+            return
+        match.state = 'ended'
+        match.ended_at = now
+        del self._matches[match_id]
+        self._ended.append(match)
+
+    def expire(self, now=None):
+        """長時間確認できていない試合は、通知せずに破棄する"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for match_id, match in list(self._matches.items()):
+                if now - match.last_seen >= self.retention:
+                    del self._matches[match_id]
+                    self._dirty.add(match_id)
+                    for player_name in match.active:
+                        if self._player_match.get(player_name) == match_id:
+                            del self._player_match[player_name]
+
+    def add_players(self, match_id, players):
+        """同じページに載っていた監視対象を参加者として記録する（試合終了の判定には使わない）"""
+        with self._lock:
+            match = self._matches.get(match_id)
+            if match is None:
+                return
+            for player_name, champion in players.items():
+                if player_name not in match.players:
+                    match.players[player_name] = champion
+                    self._dirty.add(match_id)
+
+    def drain_ended(self):
+        """前回から終了した試合を取り出す"""
+        with self._lock:
+            ended, self._ended = self._ended, []
+        return ended
+
+    def forget(self, player_name):
+        with self._lock:
+            match_id = self._player_match.pop(player_name, None)
+            match = self._matches.get(match_id)
+            if match is not None:
+                match.players.pop(player_name, None)
+                match.active.discard(player_name)
+                if not match.active:
+                    del self._matches[match_id]
+                self._dirty.add(match_id)
+
+    def changes(self):
+        """保存用に、前回から変更された試合を {match_id: as_dict の形式（終了・破棄した試合はNone）} で返す"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return {
+                match_id: self._matches[match_id].as_dict() if match_id in self._matches else None
+                for match_id in dirty
+            }
+
+    def mark_dirty(self, match_ids):
+        """保存に失敗した試合を、次回も保存するよう戻す"""
+        with self._lock:
+            self._dirty |= set(match_ids)
+
+    def restore(self, data):
+        """保存済みの進行中の試合（as_dict の形式）を読み込む"""
+        match = MatchState.from_dict(data)
+        with self._lock:
+            self._matches[match.match_id] = match
+            for player_name in match.active:
+                self._player_match[player_name] = match.match_id
+
+class PlayerStats:
+    """プレイヤーごとの直近の試合の記録（件数の上限つき）"""
+
+    __slots__ = ('games',)
+
+    def __init__(self, history):
+        self.games = deque(maxlen=history)  # (開始を検出した時刻, 試合タイプ, チャンピオン)
+
+    def games_per_day(self, now=None, days=7):
+        now = time.time() if now is None else now
+        return sum(1 for started, _, _ in self.games if now - started < days * 86400) / days
+
+    def queue_mix(self):
+        counts = {}
+        for _, game_type, _ in self.games:
+            counts[game_type] = counts.get(game_type, 0) + 1
+        return counts
+
+    def champion_frequency(self):
+        counts = {}
+        for _, _, champion in self.games:
+            counts[champion] = counts.get(champion, 0) + 1
+        return counts
+
+    def start_likelihood(self, now=None):
+        """現在時刻の前後1時間に試合を始めた割合（記録が少ない間は0）"""
+        if len(self.games) < 5:
+            return 0.0
+        now = time.time() if now is None else now
+        hour = datetime.fromtimestamp(now).hour
+        near = 0
+        for started, _, _ in self.games:
+            distance = abs(datetime.fromtimestamp(started).hour - hour)
+            if min(distance, 24 - distance) <= 1:
+                near += 1
+        return near / len(self.games)
+
+class PlayerStatsRegistry:
+    """プレイヤーごとの PlayerStats（名簿の人数分まで）"""
+
+    def __init__(self, history=PLAYER_STATS_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record_game(self, player_name, game_type, champion, started=None):
+        with self._lock:
+            stats = self._stats.get(player_name)
+            if stats is None:
+                stats = self._stats[player_name] = PlayerStats(self.history)
+            stats.games.append((time.time() if started is None else started, game_type, champion))
+
+    def get(self, player_name):
+        with self._lock:
+            return self._stats.get(player_name)
+
+    def start_likelihood(self, player_name):
+        stats = self.get(player_name)
+        return stats.start_likelihood() if stats is not None else 0.0
+
+    def forget(self, player_name):
+        with self._lock:
+            self._stats.pop(player_name, None)
+
+MATCH_LIFECYCLE = MatchLifecycle()
+PLAYER_STATS = PlayerStatsRegistry()
+
+# プレイヤーごとの直前のチェック結果（in_game / offline / not_found / error / unknown）
+player_last_status = {}
+# player_status イベントとして最後に配った状態
+player_event_status = {}
 
 # 環境変数の読み込み
 SAVE_HTML_LOG = os.getenv('SAVE_HTML_LOG', 'false').lower() == 'true'
+# HTMLログのアーカイブ設定
+HTML_ARCHIVE_DIR = os.getenv('HTML_ARCHIVE_DIR', 'logs')
+# 書き込み待ちの上限（超えた分は保存せずに捨てる）
+HTML_ARCHIVE_QUEUE_MAX = max(1, int(os.getenv('HTML_ARCHIVE_QUEUE_MAX', '256')))
+# セグメントを切り替えるサイズ（圧縮後のバイト数）と経過時間（秒）
+HTML_ARCHIVE_SEGMENT_BYTES = int(os.getenv('HTML_ARCHIVE_SEGMENT_BYTES', str(32 * 1024 * 1024)))
+HTML_ARCHIVE_SEGMENT_AGE = float(os.getenv('HTML_ARCHIVE_SEGMENT_AGE', '3600'))
+# 保持するセグメント数（古いものから削除）
+HTML_ARCHIVE_RETENTION = max(1, int(os.getenv('HTML_ARCHIVE_RETENTION', '48')))
+
+# レスポンスキャッシュの設定
+# ETag/Last-Modified とプレイヤーごとの判定結果を保持する件数の上限
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2048'))
+# 「試合中でない」「存在しない」と判定したプレイヤーの再取得を省略する時間（秒、0で無効）
+# 試合終了直後の短い間隔（SCHEDULE_ACTIVE_INTERVAL の-10%から、SCHEDULER_TICK だけ前倒し）のチェックを
+# 省略しないよう、「試合中でない」はそれより短くする
+RESULT_CACHE_TTL = min(
+    float(os.getenv('RESULT_CACHE_TTL', '30')), 0.9 * SCHEDULE_ACTIVE_INTERVAL - SCHEDULER_TICK - 1
+)
+NOT_FOUND_CACHE_TTL = float(os.getenv('NOT_FOUND_CACHE_TTL', '600'))
+
+# 名簿の検証（起動時と名簿の再読み込み時に、取得元に存在しないプレイヤーを監視から外す）
+ROSTER_VALIDATION = os.getenv('ROSTER_VALIDATION', 'true').lower() == 'true'
+# 「存在する」と確認した結果を再利用する期間（秒）
+ROSTER_VALIDATION_TTL = float(os.getenv('ROSTER_VALIDATION_TTL', str(24 * 3600)))
+# 存在しないプレイヤーを再確認するまでの間隔（秒、見つからないたびに倍にする）と上限
+QUARANTINE_RECHECK_INTERVAL = float(os.getenv('QUARANTINE_RECHECK_INTERVAL', str(6 * 3600)))
+QUARANTINE_MAX_INTERVAL = float(os.getenv('QUARANTINE_MAX_INTERVAL', str(7 * 24 * 3600)))
+
+# ログの設定
+# 出力形式（text / json）とレベル
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# プレイヤーごとの判定結果など、件数の多いログを出力する割合（1で全件、警告以上は常に出力）
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+# 出力待ちのログの上限（超えた分は捨てる）
+LOG_QUEUE_MAX = max(1, int(os.getenv('LOG_QUEUE_MAX', '10000')))
+
+# プロファイルの設定（kill -USR1 / -USR2 または POST /debug/profile で開始する）
+# 出力先と、1回の指示で計測するスイープ数
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs/profiles')
+PROFILE_SWEEPS = max(1, int(os.getenv('PROFILE_SWEEPS', '3')))
+# 結果のテキストに出力する上位の件数と、tracemalloc が記録するスタックの深さ
+PROFILE_TOP_N = max(1, int(os.getenv('PROFILE_TOP_N', '30')))
+PROFILE_TRACE_FRAMES = max(1, int(os.getenv('PROFILE_TRACE_FRAMES', '10')))
+# POST /debug/profile に必要なトークン（X-Admin-Token ヘッダー）。未設定ならHTTPからは受け付けない
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+
+# イベント出力の設定
+# 書き出し先（種類=宛先 をカンマ区切り。jsonl=ファイル / unix=ソケット / sqlite=DB / http=URL）
+# 例: jsonl=logs/events.jsonl,sqlite=state/events.db,http=http://127.0.0.1:9000/events
+EVENT_SINKS = os.getenv('EVENT_SINKS', '')
+# 書き出し先に渡すイベントの種類（カンマ区切り。空なら全て）
+EVENT_TYPES = os.getenv('EVENT_TYPES', '')
+# Discordへの通知もイベントの購読者として行う（falseでDiscordへ送らない）
+EVENT_DISCORD = os.getenv('EVENT_DISCORD', 'true').lower() == 'true'
+# 書き出し先ごとの待ちイベントの上限と、一度に書き出す件数・まとめる待ち時間（秒）
+EVENT_BUFFER_MAX = max(1, int(os.getenv('EVENT_BUFFER_MAX', '10000')))
+EVENT_BATCH_SIZE = max(1, int(os.getenv('EVENT_BATCH_SIZE', '100')))
+EVENT_FLUSH_INTERVAL = float(os.getenv('EVENT_FLUSH_INTERVAL', '1'))
+# 待ちイベントが上限に達したとき、空くまで発行側が待つ秒数（0ならすぐに捨てる）
+EVENT_BLOCK_TIMEOUT = float(os.getenv('EVENT_BLOCK_TIMEOUT', '0'))
+# ソケット・HTTPの書き出し先のタイムアウト（秒）
+EVENT_SINK_TIMEOUT = float(os.getenv('EVENT_SINK_TIMEOUT', '5'))
 
-def save_html_log(player_name, content):
-    """HTMLレスポンスをログとして保存する関数（ログ出力なし）"""
+# ヘルスチェック・メトリクス用HTTPサーバーの設定（ポート0で無効）
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', '8000'))
+# 最後にスイープが完了してからこの秒数を過ぎると /health は異常を返す
+HEALTH_MAX_SWEEP_AGE = float(os.getenv('HEALTH_MAX_SWEEP_AGE', '900'))
+
+# 状態の永続化の設定（保存先: sqlite / none）
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').lower()
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'state/watcher.db')
+
+# 複数レプリカでの分担（シャーディング）の設定。SHARD_STORE_PATH を全レプリカで共有すると有効になる
+SHARD_STORE_PATH = os.getenv('SHARD_STORE_PATH', '')
+SHARD_REPLICA_ID = os.getenv('SHARD_REPLICA_ID', '') or f"{socket.gethostname()}-{os.getpid()}"
+# レプリカの生存を示すリースの有効期間と、更新間隔（秒）
+SHARD_LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', '60'))
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv('SHARD_HEARTBEAT_INTERVAL', '15'))
+# コンシステントハッシュのレプリカあたりの仮想ノード数
+SHARD_VIRTUAL_NODES = max(1, int(os.getenv('SHARD_VIRTUAL_NODES', '64')))
+
+def _archive_codec():
+    """zstandard があればzstd、なければgzipで圧縮する"""
+    try:
+        import zstandard
+    except ImportError:
+        return '.gz', lambda data: gzip.compress(data, compresslevel=6)
+    return '.zst', zstandard.ZstdCompressor(level=3).compress
+
+class HtmlArchive:
+    """HTMLレスポンスを圧縮したセグメントファイルにまとめて保存する
+
+    ページは1件ずつ独立したフレームとして圧縮して追記し、セグメントごとの索引
+    （プレイヤー・時刻・判定結果 → オフセット）から個別に取り出せるようにする。
+    書き込みはバックグラウンドのスレッドで行い、ポーリングのスレッドは待たない。
+    """
+
+    INDEX_SUFFIX = '.idx.jsonl'
+
+    def __init__(self, directory, queue_max=HTML_ARCHIVE_QUEUE_MAX,
+                 segment_bytes=HTML_ARCHIVE_SEGMENT_BYTES, segment_age=HTML_ARCHIVE_SEGMENT_AGE,
+                 retention=HTML_ARCHIVE_RETENTION):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.retention = retention
+        self._queue = queue.Queue(maxsize=queue_max)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.extension = None
+        self._compress = None
+        self._segment = None
+        self._index = None
+        self._segment_name = None
+        self._segment_started = 0.0
+        self.written = 0
+        self.dropped = 0
+
+    def enqueue(self, player_name, content, outcome=None, truncated=False):
+        """保存を予約する。書き込みが追いつかない場合は捨ててFalseを返す
+
+        truncated は読み込みの上限で本文が途中までしかない場合にTrueとし、索引に記録する。
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='html-archive', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        try:
+            self._queue.put_nowait((player_name, time.time(), outcome, content, truncated))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self, timeout=10):
+        """待機中のページを書き出してからスレッドを止める"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _run(self):
+        self.extension, self._compress = _archive_codec()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._close_segment()
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                logging.error(f"HTMLログの保存に失敗しました: {str(e)}")
+
+    def _write(self, player_name, timestamp, outcome, content, truncated=False):
+        data = self._compress(content.encode('utf-8'))
+        if (self._segment is None or self._segment.tell() >= self.segment_bytes
+                or time.time() - self._segment_started >= self.segment_age):
+            self._rotate()
+        offset = self._segment.tell()
+        self._segment.write(data)
+        self._segment.flush()
+        self._index.write(json.dumps({
+            'player': player_name, 'ts': timestamp, 'outcome': outcome,
+            'segment': self._segment_name, 'offset': offset, 'length': len(data), 'truncated': truncated,
+        }, ensure_ascii=False) + '\n')
+        self._index.flush()
+        self.written += 1
+
+    def _rotate(self):
+        self._close_segment()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment_started = time.time()
+        self._segment_name = f"html_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{self.extension}"
+        self._segment = open(self.directory / self._segment_name, 'ab')
+        self._index = open(self.directory / (self._segment_name + self.INDEX_SUFFIX), 'a', encoding='utf-8')
+        self._prune()
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = self._index = None
+
+    def _prune(self):
+        # 保持数を超えた古いセグメントを索引ごと削除する
+        segments = sorted(
+            path for path in self.directory.glob('html_*')
+            if not path.name.endswith(self.INDEX_SUFFIX)
+        )
+        for segment in segments[:-self.retention]:
+            segment.unlink()
+            index_path = Path(str(segment) + self.INDEX_SUFFIX)
+            if index_path.exists():
+                index_path.unlink()
+
+    @classmethod
+    def find(cls, directory, player_name=None, outcome=None, since=None):
+        """索引から条件に合う保存済みページのエントリを古い順に返す"""
+        for index_path in sorted(Path(directory).glob('html_*' + cls.INDEX_SUFFIX)):
+            with open(index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 書き込み途中で終了した行
+                    if player_name is not None and entry['player'] != player_name:
+                        continue
+                    if outcome is not None and entry['outcome'] != outcome:
+                        continue
+                    if since is not None and entry['ts'] < since:
+                        continue
+                    yield entry
+
+    @classmethod
+    def read(cls, directory, entry):
+        """索引のエントリが指すページを取り出す"""
+        segment = entry['segment']
+        if segment.endswith('.zst'):
+            import zstandard
+            decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            decompress = gzip.decompress
+        with open(Path(directory) / segment, 'rb') as f:
+            f.seek(entry['offset'])
+            return decompress(f.read(entry['length'])).decode('utf-8', errors='replace')
+
+HTML_ARCHIVE = HtmlArchive(HTML_ARCHIVE_DIR)
+
+def save_html_log(player_name, content, outcome=None, truncated=False):
+    """HTMLレスポンスをアーカイブに保存する（書き込みはバックグラウンドで行う）"""
     if not SAVE_HTML_LOG:
         return
-        
-    # logsディレクトリが存在しない場合は作成
-    log_dir = Path('logs')
-    log_dir.mkdir(exist_ok=True)
-    
-    # プレイヤー名から安全なファイル名を作成
-    safe_name = player_name.replace('#', '-').replace(':', '_')
-    
-    # 現在の日時をファイル名に含める
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{safe_name}_{timestamp}.html"
-    
-    # ログファイルを保存
-    log_path = log_dir / filename
+    HTML_ARCHIVE.enqueue(player_name, content, outcome, truncated)
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット（全ワーカーで共有するレート制限）"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """待たずにトークンを取得する。取得できなければ次に取得できるまでの秒数を返す"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """トークンを1つ取得できるまで待機する"""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+# porofessor.gg 向けの全体レート制限とワーカープール
+RATE_LIMITER = TokenBucket(POROFESSOR_RATE_LIMIT, POROFESSOR_RATE_BURST)
+POLL_EXECUTOR = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix='poller')
+
+class FetchStats:
+    """ページ取得の累計（読み込んだバイト数や早期終了の回数）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.bytes_read = 0
+        self.early_stops = 0
+        self.truncated = 0
+        self.max_page_bytes = 0
+        self.max_buffer_bytes = 0
+
+    def record(self, page):
+        with self._lock:
+            self.pages += 1
+            self.bytes_read += page.bytes_read
+            self.early_stops += page.early_stopped
+            self.truncated += page.truncated
+            self.max_page_bytes = max(self.max_page_bytes, page.bytes_read)
+            self.max_buffer_bytes = max(self.max_buffer_bytes, page.scanner.peak_buffer)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pages': self.pages,
+                'bytes_read': self.bytes_read,
+                'early_stops': self.early_stops,
+                'truncated': self.truncated,
+                'max_page_bytes': self.max_page_bytes,
+                'max_buffer_bytes': self.max_buffer_bytes,
+            }
+
+FETCH_STATS = FetchStats()
+
+class StageTimers:
+    """1回のスイープの段階別（待機・取得・デコード・小文字化・分類・抽出・通知）の所要時間を集計する"""
+
+    STAGES = ('throttle', 'fetch', 'decode', 'lower', 'classify', 'extract', 'notify')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(self.STAGES, 0.0)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._totals[stage] += seconds
+
+    def add_page(self, page, elapsed):
+        """取得したページの内訳を加算する（ネットワーク待ちはデコードと走査を除いた残り）
+
+        走査（feed と close）の時間のうち、分類と抽出以外（小文字化とバッファの連結・切り詰め）は lower に入れる。
+        """
+        scanner = page.scanner
+        scanned = scanner.classify_seconds + scanner.extract_seconds
+        with self._lock:
+            self._totals['fetch'] += max(0.0, elapsed - page.decode_seconds - page.parse_seconds)
+            self._totals['decode'] += page.decode_seconds
+            self._totals['lower'] += max(0.0, page.parse_seconds - scanned)
+            self._totals['classify'] += scanner.classify_seconds
+            self._totals['extract'] += scanner.extract_seconds
+
+    def drain(self):
+        """集計を返してゼロに戻す"""
+        with self._lock:
+            totals = self._totals
+            self._totals = dict.fromkeys(self.STAGES, 0.0)
+        return totals
+
+STAGE_TIMERS = StageTimers()
+
+# JSON形式のログに出力する追加フィールド（logging の extra で渡す）
+LOG_FIELDS = ('player', 'outcome', 'latency', 'bytes', 'provider', 'match_id', 'status', 'url')
+# 件数の多いログに付ける extra（LOG_SAMPLE_RATE の割合だけ出力する）
+SAMPLED = {'sampled': True}
+
+class JsonFormatter(logging.Formatter):
+    """1行に1レコードのJSONで出力する"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """extra に sampled を付けたINFO以下のログを、rate の割合だけ通す"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """ログを書式化せずにキューへ渡す（書式化と出力は QueueListener のスレッドで行う）"""
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE):
+    """ログをキュー経由で別スレッドから出力するように設定し、QueueListener を返す"""
+    output = logging.StreamHandler()
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    handler = LazyQueueHandler(queue.Queue(LOG_QUEUE_MAX))
+    handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+class Metric:
+    """Prometheusのテキスト形式で出力するカウンター・ゲージ"""
+
+    def __init__(self, name, help_text, metric_type, labelnames=(), func=None):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.labelnames = labelnames
+        self._func = func  # 出力時に値を取得する関数（他の集計から読む場合）
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def _samples(self):
+        if self._func is not None:
+            value = self._func()
+            return [] if value is None else [f"{self.name} {value}"]
+        with self._lock:
+            return [f"{self.name}{self._label_text(key)} {value}" for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        return '\n'.join(lines + self._samples())
+
+class Histogram(Metric):
+    """バケットごとの件数と合計値を持つヒストグラム"""
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        super().__init__(name, help_text, 'histogram', labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # バケットごとの件数（最後は+Inf）、合計、件数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    samples.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+                samples.append(f"{self.name}_sum{self._label_text(key)} {total}")
+                samples.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return samples
+
+class MetricsRegistry:
+    """/metrics で出力するメトリクスの一覧"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+def process_rss_bytes():
+    """プロセスの常駐メモリ量（psutilがない場合はNone）"""
     try:
-        with open(log_path, 'w', encoding='utf-8') as f:
-            for chunk in content.split('\n'):
-                f.write(chunk + '\n')
-    except Exception as e:
-        logging.error(f"HTMLログの保存に失敗しました: {str(e)}")
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+METRICS = MetricsRegistry()
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_FETCH_SECONDS = METRICS.register(Histogram(
+    'watcher_fetch_duration_seconds', 'Time to fetch and classify one page', LATENCY_BUCKETS, ('outcome',)))
+METRIC_PARSE_SECONDS = METRICS.register(Histogram(
+    'watcher_parse_duration_seconds', 'Time spent scanning one page',
+    (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)))
+METRIC_SWEEP_SECONDS = METRICS.register(Histogram(
+    'watcher_sweep_duration_seconds', 'Duration of one polling sweep', (1, 2.5, 5, 10, 30, 60, 120, 300, 600)))
+METRIC_SWEEP_PLAYERS = METRICS.register(Metric(
+    'watcher_sweep_players_total', 'Players checked in sweeps', 'counter'))
+METRIC_WEBHOOK_SECONDS = METRICS.register(Histogram(
+    'watcher_webhook_duration_seconds', 'Discord webhook request latency', LATENCY_BUCKETS, ('status',)))
+METRIC_SCHEDULED_PLAYERS = METRICS.register(Metric(
+    'watcher_scheduled_players', 'Players in the polling scheduler', 'gauge'))
+METRIC_CACHE_HITS = METRICS.register(Metric(
+    'watcher_cache_hits_total', 'Fetches answered by the response cache', 'counter', ('kind',)))
+METRIC_STARTUP_SECONDS = METRICS.register(Metric(
+    'watcher_startup_seconds', 'Seconds from process start until each startup phase finished', 'gauge', ('phase',)))
+METRIC_STAGE_SECONDS = METRICS.register(Metric(
+    'watcher_stage_seconds_total', 'Time spent in each stage of the polling sweeps', 'counter', ('stage',)))
+METRIC_PROVIDER_REQUESTS = METRICS.register(Metric(
+    'watcher_provider_requests_total', 'Live page requests per provider', 'counter', ('provider', 'outcome')))
+METRIC_PROVIDER_HEDGES = METRICS.register(Metric(
+    'watcher_provider_hedged_requests_total', 'Requests sent to a provider because the previous one was slow',
+    'counter', ('provider',)))
+METRIC_PROVIDER_LATENCY = METRICS.register(Metric(
+    'watcher_provider_latency_seconds', 'Moving average of request latency per provider', 'gauge', ('provider',)))
+METRIC_PROVIDER_SUCCESS = METRICS.register(Metric(
+    'watcher_provider_success_ratio', 'Moving average of the success ratio per provider', 'gauge', ('provider',)))
+METRIC_EVENTS_PUBLISHED = METRICS.register(Metric(
+    'watcher_events_published_total', 'Events published to subscribers', 'counter', ('type',)))
+METRIC_EVENTS_WRITTEN = METRICS.register(Metric(
+    'watcher_events_written_total', 'Events written by each event sink', 'counter', ('sink',)))
+METRIC_EVENTS_DROPPED = METRICS.register(Metric(
+    'watcher_events_dropped_total', 'Events dropped because a sink buffer was full or a write failed at shutdown',
+    'counter', ('sink',)))
+METRICS.register(Metric(
+    'watcher_time_to_first_request_seconds', 'Seconds from process start until the first live page response', 'gauge',
+    func=lambda: STARTUP.first_request))
+METRICS.register(Metric(
+    'watcher_fetch_bytes_total', 'Bytes downloaded from live pages', 'counter',
+    func=lambda: FETCH_STATS.snapshot()['bytes_read']))
+METRICS.register(Metric(
+    'watcher_pages_fetched_total', 'Live pages fetched', 'counter',
+    func=lambda: FETCH_STATS.snapshot()['pages']))
+METRICS.register(Metric(
+    'watcher_fetch_early_stops_total', 'Fetches closed early at a summoner-not-found marker', 'counter',
+    func=lambda: FETCH_STATS.snapshot()['early_stops']))
+METRICS.register(Metric(
+    'watcher_discord_queue_depth', 'Messages waiting in the Discord delivery queue', 'gauge',
+    func=lambda: DISCORD_DISPATCHER.depth()))
+METRICS.register(Metric(
+    'watcher_event_buffer_depth', 'Events waiting in the event sink buffers', 'gauge',
+    func=lambda: EVENTS.depth()))
+METRICS.register(Metric(
+    'watcher_html_archive_written_total', 'HTML captures written to the archive', 'counter',
+    func=lambda: HTML_ARCHIVE.written))
+METRICS.register(Metric(
+    'watcher_html_archive_dropped_total', 'HTML captures dropped because the archive queue was full', 'counter',
+    func=lambda: HTML_ARCHIVE.dropped))
+METRICS.register(Metric(
+    'watcher_active_matches', 'Matches with tracked players still in game', 'gauge',
+    func=lambda: len(MATCH_LIFECYCLE)))
+METRICS.register(Metric(
+    'watcher_circuit_open_hosts', 'Hosts whose circuit breaker is currently open', 'gauge',
+    func=lambda: HTTP_CLIENT.open_circuits()))
+METRICS.register(Metric(
+    'watcher_quarantined_players', 'Roster players excluded from polling because they were not found', 'gauge',
+    func=lambda: len(ROSTER_VALIDATOR.quarantine)))
+METRICS.register(Metric(
+    'watcher_last_sweep_timestamp_seconds','Unix time of the last completed sweep', 'gauge',
+    func=lambda: HEALTH.last_sweep))
+METRICS.register(Metric(
+    'watcher_process_resident_memory_bytes', 'Resident set size of the watcher process', 'gauge',
+    func=process_rss_bytes))
+
+class SweepContext:
+    """1回のスイープ内で、取得済みのページから判明したプレイヤーを共有する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = set()      # このスイープでチェック済み（または他のページで解決済み）のプレイヤー
+        self.shared_results = {}  # 他のプレイヤーのページから解決したマッチ情報
+        self.page_players = {}    # match_id -> ページに載っていた監視対象（他のシャードの担当を含む） -> チャンピオン
+        self.fetch_stats_start = FETCH_STATS.snapshot()
+        self._deferred = []       # live-partialを取得する (時刻, プレイヤー, 試行回数) のヒープ
+
+    def claim(self, player_name):
+        """まだチェックされていなければ確保してTrueを返す"""
+        with self._lock:
+            if player_name in self.checked:
+                return False
+            self.checked.add(player_name)
+            return True
+
+    def add_shared_result(self, player_name, result):
+        with self._lock:
+            self.shared_results[player_name] = result
+
+    def add_page_players(self, match_id, players):
+        with self._lock:
+            self.page_players.setdefault(match_id, {}).update(players)
 
-def check_all_players():
+    def defer_partial(self, player_name, attempt=1, delay=PARTIAL_RETRY_DELAY):
+        """ローディング中だったプレイヤーのlive-partialを、delay秒後に取得するよう予約する"""
+        with self._lock:
+            heapq.heappush(self._deferred, (time.monotonic() + delay, player_name, attempt))
+
+    def has_deferred(self):
+        with self._lock:
+            return bool(self._deferred)
+
+    def pop_due_partials(self):
+        """期限が来た (プレイヤー, 試行回数) と、次の期限までの秒数を返す"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._deferred and self._deferred[0][0] <= now:
+                _, player_name, attempt = heapq.heappop(self._deferred)
+                due.append((player_name, attempt))
+            wait = max(0.0, self._deferred[0][0] - now) if self._deferred else None
+        return due, wait
+
+def group_by_party(player_names):
+    """直近のマッチが同じだったプレイヤーを同じグループにまとめる"""
+    groups = {}
+    for player_name in player_names:
+        latest = MATCH_INDEX.current(player_name)
+        key = ('match', latest.match_id) if latest else ('player', player_name)
+        groups.setdefault(key, []).append(player_name)
+    return list(groups.values())
+
+def check_player_group(player_names, sweep):
+    """同じパーティーと思われるプレイヤーを順番にチェックする"""
+    # 先にチェックしたプレイヤーのページで解決したメンバーは取得を省略する
+    results = {}
+    for player_name in player_names:
+        if sweep.claim(player_name):
+            results[player_name] = check_player_status(player_name, sweep)
+    return results
+
+def check_players(player_names):
+    """指定したプレイヤーをまとめてチェックし、結果を通知する（1回のスイープ）
+
+    このスイープでチェック済みになったプレイヤー（同じページから解決した分を含む）を返す。
+    """
+    sweep_started = time.monotonic()
     match_groups = {}
-    not_found_players = []
+    sweep = SweepContext()
     
-    # プレイヤーを一人ずつ順番にチェック
-    for player_name in PLAYER_DICT.keys():
+    # パーティー単位で並列にチェック（同時実行数はPOLL_WORKERS、送信間隔はRATE_LIMITERで制御）
+    pending = {
+        POLL_EXECUTOR.submit(PROFILER.wrap(check_player_group), group, sweep)
+        for group in group_by_party(player_names)
+    }
+    results = {}
+    # ローディング中だったプレイヤーのlive-partialは、他のチェックと並行して期限が来たものから取得する
+    while pending or sweep.has_deferred():
+        due, wait = sweep.pop_due_partials()
+        for player_name, attempt in due:
+            pending.add(POLL_EXECUTOR.submit(PROFILER.wrap(check_partial_status), player_name, attempt, sweep))
+        if not pending:
+            time.sleep(wait)
+            continue
+        done, pending = concurrent.futures.wait(pending, wait, concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                results.update(future.result())
+            except Exception as e:
+                logging.error("エラーが発生しました: %s", e)
+    results.update(sweep.shared_results)
+
+    fetched = FETCH_STATS.snapshot()
+    pages = fetched['pages'] - sweep.fetch_stats_start['pages']
+    if pages:
+        bytes_read = fetched['bytes_read'] - sweep.fetch_stats_start['bytes_read']
+        logging.info(
+            "取得: %dページ / %.1fKB（早期終了 %d）", pages, bytes_read / 1024,
+            fetched['early_stops'] - sweep.fetch_stats_start['early_stops'], extra={'bytes': bytes_read}
+        )
+
+    for player_name, result in results.items():
         try:
-            result = check_player_status(player_name)
-            
-            if result:
+            # エラーはチェック時に記録・通知済み
+            if result and result != "error":
                 if result == "not_found":
-                    not_found_players.append((player_name, PLAYER_DICT[player_name]))
-                    logging.info(f"{PLAYER_DICT[player_name]}({player_name})の試合情報は見つかりませんでした")
+                    logging.info(
+                        "%s(%s)の試合情報は見つかりませんでした", PLAYER_DICT[player_name], player_name,
+                        extra={'player': player_name, 'outcome': 'not_found', **SAMPLED}
+                    )
                 else:
                     match_id = result['match_id']
                     if match_id not in match_groups:
                         match_groups[match_id] = []
                     result['nickname'] = PLAYER_DICT[player_name]
                     match_groups[match_id].append(result)
-                    logging.info(f"{PLAYER_DICT[player_name]}({player_name})の試合が見つかりました: {result['game_type']}")
+                    logging.info(
+                        "%s(%s)の試合が見つかりました: %s", PLAYER_DICT[player_name], player_name, result['game_type'],
+                        extra={'player': player_name, 'outcome': 'in_game', 'match_id': match_id}
+                    )
                     
         except Exception as e:
-            logging.error(f"エラーが発生しました（{PLAYER_DICT[player_name]}({player_name})）: {str(e)}")
+            logging.error("エラーが発生しました（%s(%s)）: %s", PLAYER_DICT[player_name], player_name, e)
             continue
-        
-        # プレイヤーごとに少し待機（サーバー負荷軽減のため）
-        #time.sleep(1)
     
     # 結果の処理
-    if match_groups or not_found_players:
-        send_discord_notification(match_groups, not_found_players)
+    # 複数レプリカの場合、同じマッチは最初に取得したレプリカだけが通知する
+    for match_id in [match_id for match_id in match_groups if not CLUSTER.claim_match(match_id)]:
+        logging.info("他のレプリカが通知済みのためスキップします (Match ID: %s)", match_id, extra={'match_id': match_id})
+        del match_groups[match_id]
+    # 他のシャードが担当するプレイヤーは登録・チェックしないが、取得権を得たレプリカが全員をまとめて通知できるよう、
+    # ページに載っていた分を参加者に加える（試合終了の通知でも同じ参加者を使う）
+    for match_id, page_players in sweep.page_players.items():
+        MATCH_LIFECYCLE.add_players(match_id, page_players)
+        players = match_groups.get(match_id)
+        if players is None:
+            continue
+        listed = {player['player_name'] for player in players}
+        for teammate, champion in page_players.items():
+            if teammate in listed or CLUSTER.owns(teammate):
+                continue
+            players.append({
+                'match_id': match_id, 'player_name': teammate, 'champion': champion, 'game_type': players[0]['game_type'],
+                'url': live_page_url(teammate), 'nickname': PLAYER_DICT.get(teammate),
+            })
+
+    # 試合の開始・終了と状態の変化をまとめてイベントとして配る（Discordへの通知も購読者の1つ）
+    notify_started = time.perf_counter()
+    events = [
+        EVENTS.event(
+            'match_started', match_id=match_id, game_type=players[0]['game_type'], url=players[0]['url'],
+            players=[
+                {
+                    'player': player['player_name'], 'nickname': player['nickname'], 'champion': player['champion'],
+                    'category': PLAYER_CATEGORIES.get(player['player_name'], 'friend'),
+                }
+                for player in players
+            ],
+        )
+        for match_id, players in match_groups.items()
+    ]
+    ended_matches = MATCH_LIFECYCLE.drain_ended()
+    if ended_matches and EVENTS.wants('match_ended'):
+        events.extend(
+            EVENTS.event(
+                'match_ended', match_id=match.match_id, game_type=match.game_type, url=match.url,
+                players=[
+                    {
+                        'player': player_name, 'nickname': PLAYER_DICT.get(player_name), 'champion': champion,
+                        'category': PLAYER_CATEGORIES.get(player_name),
+                    }
+                    for player_name, champion in match.players.items()
+                ],
+                started_at=match.first_seen, ended_at=match.ended_at, duration=list(match.duration_range()),
+            )
+            for match in ended_matches if CLUSTER.claim_match(f"{match.match_id}:ended")
+        )
+    if EVENTS.wants('player_status'):
+        for player_name in sweep.checked:
+            status = player_last_status.get(player_name)
+            previous = player_event_status.get(player_name)
+            if status != previous:
+                player_event_status[player_name] = status
+                events.append(EVENTS.event('player_status', player=player_name, status=status, previous=previous))
+    if EVENTS.wants('sweep_completed'):
+        events.append(EVENTS.event(
+            'sweep_completed', players=len(sweep.checked), matches=len(match_groups),
+            seconds=time.monotonic() - sweep_started,
+        ))
+    if events:
+        EVENTS.publish_batch(events)
+    STAGE_TIMERS.add('notify', time.perf_counter() - notify_started)
     
     # 使用済みデータの明示的なクリア
     match_groups.clear()
-    not_found_players.clear()
 
-def send_discord_notification(match_groups, not_found_players):
+    # このスイープでの状態の変更をまとめて保存
+    STATE_STORE.flush()
+
+    stage_seconds = STAGE_TIMERS.drain()
+    for stage, seconds in stage_seconds.items():
+        METRIC_STAGE_SECONDS.inc(seconds, stage=stage)
+    logging.info(
+        "段階別の所要時間（ワーカーの合計）: %s",
+        ' / '.join(f"{stage} {seconds:.3f}s" for stage, seconds in stage_seconds.items())
+    )
+
+    METRIC_SWEEP_SECONDS.observe(time.monotonic() - sweep_started)
+    METRIC_SWEEP_PLAYERS.inc(len(sweep.checked))
+    HEALTH.mark_sweep()
+    return sweep.checked
+
+def send_discord_notification(match_groups):
     category_messages = {category: [] for category in WEBHOOK_URLS.keys()}
     
     current_time = (datetime.now() + timedelta(hours=9)).strftime('%Y年%m月%d日 %H:%M:%S')
@@ -207,331 +1523,1744 @@ def send_discord_notification(match_groups, not_found_players):
                 category_message += f"> 試合タイプ：`{game_type}`\n> {url}\n\n"
                 category_messages[category].append(category_message)
     
-    # カテゴリごとにWebhookを送信
+    # カテゴリごとにWebhookの送信キューへ入れる（送信はバックグラウンドで行う）
     for category, messages in category_messages.items():
         if messages and WEBHOOK_URLS[category]:
-            webhook = DiscordWebhook(url=WEBHOOK_URLS[category], content=''.join(messages))
-            webhook.execute()
+            DISCORD_DISPATCHER.enqueue(WEBHOOK_URLS[category], ''.join(messages))
 
-# グローバルセッションを作成
-class SessionManager:
-    _session = None
-    
-    @classmethod
-    def get_session(cls):
-        if cls._session is None:
-            cls._session = requests.Session()
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=0.5,
-                status_forcelist=[500, 502, 503, 504]
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            cls._session.mount("http://", adapter)
-            cls._session.mount("https://", adapter)
-        return cls._session
+def send_match_ended_notification(matches):
+    """終了した試合（match_ended イベント）と、その試合時間をカテゴリごとに通知する"""
+    category_messages = {category: [] for category in WEBHOOK_URLS.keys()}
+    current_time = (datetime.now() + timedelta(hours=9)).strftime('%Y年%m月%d日 %H:%M:%S')
 
-# グローバル変数として追加
-not_found_player_notifications = {}  # {player_name: last_notification_time}
+    for match in matches:
+        shortest, longest = match['duration']
+        category_players = {category: [] for category in WEBHOOK_URLS.keys()}
+        for player in match['players']:
+            category = player['category']
+            if category is None:
+                continue  # 名簿から外れたプレイヤー
+            prefix = f"{player['nickname']}:" if player['nickname'] else ""
+            category_players[category].append(f"`{prefix}{player['player']}({player['champion']})`")
 
-def get_player_webhook_url(player_name):
-    """プレイヤーのカテゴリに基づいてWebhook URLを取得"""
-    category = PLAYER_CATEGORIES.get(player_name, 'friend')
-    return WEBHOOK_URLS.get(category, '')
+        for category, player_list in category_players.items():
+            if player_list:
+                category_messages[category].append(
+                    f"> 🏁 **Match Ended**\n> {current_time}\n\n"
+                    f"> プレイヤー：{' / '.join(player_list)}\n"
+                    f"> 試合タイプ：`{match['game_type']}`\n"
+                    f"> 試合時間：約{shortest / 60:.0f}〜{longest / 60:.0f}分\n\n"
+                )
 
-def send_error_notification(player_name, error_message):
-    """エラーノーティフィケーションを送信"""
-    webhook_url = get_player_webhook_url(player_name)
-    if webhook_url:
-        webhook = DiscordWebhook(
-            url=webhook_url,
-            content=f"⚠️ **エラー**: `{PLAYER_DICT[player_name]}` (`{player_name}`) の情報取得中にエラーが発生しました。\n{error_message}"
-        )
-        webhook.execute()
-
-def check_player_not_found(content, player_name):
-    """プレイヤーが存在しないかチェック"""
-    not_found_patterns = [
-        'Summoner not found',
-        'summoner not found',
-        '404 - page not found',
-        'summoner-not-found',
-        'the summoner does not exist'
-    ]
-    return any(pattern in content for pattern in not_found_patterns)
-
-def check_loading_state(content):
-    """ローディング状態をチェック"""
-    loading_patterns = [
-        'damn, that\'s pretty slow to load',
-        'loadmessage',
-        'spinner'
-    ]
-    return any(pattern in content for pattern in loading_patterns)
-
-def check_in_game(content):
-    """試合中かチェック"""
-    in_game_patterns = [
-        'live-game-stats',
-        'team stats',
-        'game-status-ingame',
-        'live game',
-        'spectate'
-    ]
-    return any(pattern in content for pattern in in_game_patterns)
-
-def extract_match_id(content):
-    """コンテンツからマッチIDを抽出"""
-    match_id = None
-    result_td_start = content.find('class="resulttd"')
-    if result_td_start != -1:
-        href_start = content.find('href="https://www.leagueofgraphs.com/match/jp/', result_td_start)
-        if href_start != -1:
-            href_end = content.find('#', href_start)
-            if href_end != -1:
-                start_pos = href_start + len('href="https://www.leagueofgraphs.com/match/jp/')
-                match_id = content[start_pos:href_end]
-    return match_id
-
-def extract_game_type(content):
-    """コンテンツから試合タイプを抽出"""
-    h2_start = content.find('<h2 class="left relative">')
-    if h2_start != -1:
-        h2_end = content.find('</h2>', h2_start)
-        if h2_end != -1:
-            game_type_text = content[h2_start:h2_end].split('\n')[1].strip().lower()
-            type_mapping = {
-                'ranked solo/duo': 'RANKED SOLO/DUO',
-                'ranked flex': 'RANKED FLEX',
-                'normal (quickplay)': 'NORMAL',
-                'aram': 'ARAM',
-                'arena': 'ARENA',
-                'arurf 4v4': 'CUSTOM',
-            }
-            return type_mapping.get(game_type_text, "不明")
-    return "不明"
+    for category, messages in category_messages.items():
+        if messages and WEBHOOK_URLS[category]:
+            DISCORD_DISPATCHER.enqueue(WEBHOOK_URLS[category], ''.join(messages))
 
-def extract_champion(content, player_name):
-    """コンテンツからチャンピオン名を抽出"""
-    search_name = player_name.lower()
-    card_start = content.find(f'<div class="card card-5" data-summonername="{search_name}"')
-    if card_start == -1:
-        return "不明"
+# Discord送信キューの設定
+DISCORD_MESSAGE_LIMIT = 2000  # Discordの1メッセージあたりの文字数上限
+DISCORD_QUEUE_MAX = int(os.getenv('DISCORD_QUEUE_MAX', '1000'))
+DISCORD_MAX_RETRIES = int(os.getenv('DISCORD_MAX_RETRIES', '5'))
+# Webhookへの1回の送信のタイムアウト（秒）
+DISCORD_TIMEOUT = float(os.getenv('DISCORD_TIMEOUT', '10'))
+# Webhookごとの送信レート（リクエスト/秒）とバースト上限（Discordの上限は概ね2秒に5回）
+DISCORD_RATE_LIMIT = float(os.getenv('DISCORD_RATE_LIMIT', '1'))
+DISCORD_RATE_BURST = max(1, int(os.getenv('DISCORD_RATE_BURST', '5')))
+# 再送を諦めたメッセージの記録先
+DISCORD_DEAD_LETTER_PATH = os.getenv('DISCORD_DEAD_LETTER_PATH', 'logs/discord_dead_letter.jsonl')
 
-    box_start = content.find('<div class="box championbox', card_start)
-    if box_start == -1:
-        box_start = content.find('class="championbox', card_start)
-        if box_start == -1:
-            return "不明"
+def split_discord_message(content, limit=DISCORD_MESSAGE_LIMIT):
+    """Discordの文字数上限に収まるよう、段落・行の区切りで分割する"""
+    pieces = []
+    while len(content) > limit:
+        cut = -1
+        for separator in ('\n\n', '\n'):
+            pos = content.rfind(separator, 0, limit - len(separator) + 1)
+            if pos > 0:
+                cut = pos + len(separator)
+                break
+        if cut == -1:
+            cut = limit
+        pieces.append(content[:cut])
+        content = content[cut:]
+    pieces.append(content)
+    return [piece for piece in pieces if piece.strip()]
 
-    img_flex_start = content.find('<div class="imgflex', box_start)
-    if img_flex_start == -1:
-        return "不明"
+class DiscordDispatcher:
+    """Webhookごとのキューから、レート制限を守りながらバックグラウンドで送信する"""
 
-    img_column_start = content.find('<div class="imgcolumn-champion', img_flex_start)
-    if img_column_start == -1:
-        return "不明"
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = {}         # Webhook URL -> deque([本文, 試行回数])
+        self._buckets = {}        # Webhook URL -> TokenBucket
+        self._blocked_until = {}  # Webhook URL -> 送信を再開できる時刻（429やX-RateLimit-*による）
+        self._dead_letter_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
 
-    tooltip_start = content.find('<div class="relative requiretooltip', img_column_start)
-    if tooltip_start == -1:
-        return "不明"
+    def enqueue(self, url, content):
+        """メッセージを送信キューに入れる（ポーリングのスレッドは待たない）"""
+        if not url or not content:
+            return
+        dropped = []
+        with self._cond:
+            pending = self._queues.setdefault(url, deque())
+            for piece in split_discord_message(content):
+                if len(pending) >= DISCORD_QUEUE_MAX:
+                    dropped.append(pending.popleft()[0])
+                pending.append([piece, 0])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='discord-dispatcher', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+            self._cond.notify()
+        for message in dropped:
+            self._dead_letter(url, message, 'キューが上限に達しました')
 
-    tooltip_class_start = content.find('tooltip="', tooltip_start)
-    if tooltip_class_start == -1:
-        return "不明"
+    def depth(self):
+        """送信待ちのメッセージ数"""
+        with self._cond:
+            return sum(len(pending) for pending in self._queues.values())
 
-    alt_start = content.find('alt="', tooltip_class_start)
-    if alt_start == -1:
-        return "不明"
+    def stop(self, timeout=10):
+        """送信待ちのメッセージをできるだけ送ってから停止する"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
 
-    alt_end = content.find('"', alt_start + 5)
-    if alt_end == -1:
-        return "不明"
+    def _next_batch(self):
+        """送信できるWebhookを1つ選び、文字数上限の範囲でメッセージを結合して取り出す"""
+        now = time.monotonic()
+        wait = None
+        for url, pending in self._queues.items():
+            if not pending:
+                continue
+            delay = self._blocked_until.get(url, 0) - now
+            if delay <= 0:
+                bucket = self._buckets.setdefault(url, TokenBucket(DISCORD_RATE_LIMIT, DISCORD_RATE_BURST))
+                delay = bucket.try_acquire()
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
 
-    return content[alt_start + 5:alt_end].capitalize()
+            content, attempts = pending.popleft()
+            while pending and len(content) + 1 + len(pending[0][0]) <= DISCORD_MESSAGE_LIMIT:
+                next_content, next_attempts = pending.popleft()
+                content += '\n' + next_content
+                attempts = max(attempts, next_attempts)
+            # 他のWebhookが後回しにならないよう末尾に回す
+            self._queues[url] = self._queues.pop(url)
+            return url, content, attempts, None
+        return None, None, None, wait
 
-def check_player_status(player_name):
-    """プレイヤーの試合状態をチェック"""
-    url_player_name = player_name.replace('#', '-')
-    main_url = f"https://porofessor.gg/live/jp/{url_player_name}"
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-        'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Referer': 'https://porofessor.gg/',
-        'Cache-Control': 'no-cache'
-    }
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    url, content, attempts, wait = self._next_batch()
+                    if url is not None:
+                        break
+                    if self._stopping and wait is None:
+                        return
+                    self._cond.wait(wait)
+            self._deliver(url, content, attempts)
 
-    try:
-        logging.info(f"検索URL: {main_url}")
+    def _deliver(self, url, content, attempts):
+        started = time.monotonic()
+        try:
+            from discord_webhook import DiscordWebhook
+            response = DiscordWebhook(url=url, content=content, timeout=DISCORD_TIMEOUT).execute()
+        except Exception as e:
+            METRIC_WEBHOOK_SECONDS.observe(time.monotonic() - started, status='error')
+            self._retry(url, content, attempts, f"{type(e).__name__}: {e}", min(60, 2 ** attempts))
+            return
 
-        session = SessionManager.get_session()
-        response = session.get(main_url, headers=headers, timeout=10)
-        if response is None:
-            send_error_notification(player_name, "レスポンスがNoneです。プレイヤー名が間違っている可能性があります。")
-            print(f'エラーが発生しました: レスポンスが None です')
-            return "error"
+        status = getattr(response, 'status_code', 0)
+        METRIC_WEBHOOK_SECONDS.observe(time.monotonic() - started, status=status)
+        headers = getattr(response, 'headers', None) or {}
+        # 残り回数が0なら、リセットされるまでこのWebhookへの送信を止める
+        if headers.get('X-RateLimit-Remaining') == '0':
+            self._block(url, float(headers.get('X-RateLimit-Reset-After') or 1))
 
-        content = response.text.lower()
+        if 200 <= status < 300:
+            return
+        if status == 429:
+            self._retry(url, content, attempts, 'HTTP 429', self._retry_after(response, headers))
+        elif status >= 500 or status == 0:
+            self._retry(url, content, attempts, f"HTTP {status}", min(60, 2 ** attempts))
+        else:
+            # 4xxは再送しても成功しないため、そのまま記録する
+            self._dead_letter(url, content, f"HTTP {status}")
 
-        save_html_log(player_name, content)
+    def _retry_after(self, response, headers):
+        """429応答から待機秒数を取得する（ヘッダーがなければ本文のretry_after）"""
+        try:
+            return float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
+        try:
+            return float(response.json().get('retry_after', 1))
+        except Exception:
+            return 1.0
 
-        display_name = PLAYER_DICT[player_name] if PLAYER_DICT[player_name] else player_name
+    def _block(self, url, seconds):
+        with self._cond:
+            self._blocked_until[url] = max(self._blocked_until.get(url, 0), time.monotonic() + seconds)
 
-        # プレイヤーが存在しない場合の判定
-        if check_player_not_found(content, player_name):
-            current_time = datetime.now().timestamp()
-            last_notification = not_found_player_notifications.get(player_name, 0)
-            
-            # 3時間（10800秒）経過していれば通知
-            if current_time - last_notification >= 10800:
-                not_found_player_notifications[player_name] = current_time
-                # プレイヤーのカテゴリを取得
-                category = PLAYER_CATEGORIES.get(player_name, 'friend')
-                webhook = DiscordWebhook(
-                    url=WEBHOOK_URLS[category],
-                    content=f"⚠️ **注意**: プレイヤー `{display_name}` が存在しません。プレイヤー名を確認してください。"
-                )
-                webhook.execute()
-            
-            print('判定結果: プレイヤーが存在しません')
-            return "not_found"
-        
-        # 大きなレスポンスデータの参照を削除してメモリ解放
-        response = None
-        content = None  # contentも明示的に解放
-        
-        # ローディング状態の確認
-        if check_loading_state(content):
-            # APIエンドポイントを直接呼び出す
-            api_url = f"https://porofessor.gg/partial/live-partial/jp/{url_player_name}"
-            api_response = session.get(api_url, headers=headers, timeout=10)
-            content = api_response.text
-
-            # APIレスポンスのHTMLログも保存
-            save_html_log(f"{player_name}_api", content)
-
-            content = content.lower()
-
-        # 試合中の判定
-        if check_in_game(content):
-            # マッチIDの取得
-            match_id = extract_match_id(content)
-            if not match_id:
-                logging.warning(f"マッチIDの取得に失敗しました: {player_name}")
-                return
+    def _retry(self, url, content, attempts, reason, delay):
+        if attempts + 1 > DISCORD_MAX_RETRIES:
+            self._dead_letter(url, content, reason)
+            return
+        logging.warning(f"Discordへの送信に失敗したため{delay:.1f}秒後に再送します（{reason}）")
+        self._block(url, delay)
+        with self._cond:
+            # 順序を保つため先頭に戻す
+            self._queues.setdefault(url, deque()).appendleft([content, attempts + 1])
+            self._cond.notify()
+
+    def _dead_letter(self, url, content, reason):
+        """送信できなかったメッセージをファイルに記録する（Webhook URLは秘密情報のためカテゴリ名で記録）"""
+        category = next((cat for cat, webhook_url in WEBHOOK_URLS.items() if webhook_url == url), 'unknown')
+        logging.error(f"Discordへの送信を諦めました（{category}）: {reason}")
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'category': category,
+            'reason': reason,
+            'content': content,
+        }
+        try:
+            with self._dead_letter_lock:
+                Path(DISCORD_DEAD_LETTER_PATH).parent.mkdir(parents=True, exist_ok=True)
+                with open(DISCORD_DEAD_LETTER_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logging.error(f"送信できなかったメッセージの記録に失敗しました: {str(e)}")
+
+DISCORD_DISPATCHER = DiscordDispatcher()
+
+class EventSubscriber:
+    """イベントの購読者。types を指定した場合は、その種類のイベントだけを受け取る"""
+
+    name = 'subscriber'
+
+    def __init__(self, types=None):
+        self.types = frozenset(types) if types else None
+
+    def accepts(self, event_type):
+        return self.types is None or event_type in self.types
+
+    def deliver(self, events):
+        """同時に発行されたイベントのリストを受け取る（発行したスレッドで呼ばれる。このクラス自体は何もしない）"""
+
+    def depth(self):
+        return 0
 
-            # 試合タイプの判定
-            game_type = extract_game_type(content)
+class EventSink(EventSubscriber):
+    """イベントを上限付きのキューに溜め、バックグラウンドのスレッドでまとめて書き出す
 
-            # チャンピオンの判定
-            champion = extract_champion(content, player_name)
-            if champion == "不明":
+    キューが一杯のときは block_timeout 秒まで空くのを待ち、それでも空かなければ捨てる。
+    書き出しに失敗したバッチは、間隔を空けて同じバッチを再送する（その間に届いた分はキューに溜まる）。
+    """
+
+    def __init__(self, target, types=None, buffer_max=EVENT_BUFFER_MAX, batch_size=EVENT_BATCH_SIZE,
+                 flush_interval=EVENT_FLUSH_INTERVAL, block_timeout=EVENT_BLOCK_TIMEOUT):
+        super().__init__(types)
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=buffer_max)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def deliver(self, events):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'event-{self.name}', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        for event in events:
+            try:
+                if self.block_timeout > 0:
+                    self._queue.put(event, timeout=self.block_timeout)
+                else:
+                    self._queue.put_nowait(event)
+            except queue.Full:
+                METRIC_EVENTS_DROPPED.inc(sink=self.name)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=10):
+        """溜まっているイベントを書き出してからスレッドを止める"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout)
+
+    def write_batch(self, events):
+        """溜まったイベントをまとめて書き出す（書き出しのスレッドで呼ばれる。このクラス自体は何も書き出さない）"""
+
+    def close(self):
+        pass
+
+    def _run(self):
+        try:
+            while not (self._stopping.is_set() and self._queue.empty()):
+                batch = self._next_batch()
+                if batch:
+                    self._write(batch)
+        finally:
+            self.close()
+
+    def _next_batch(self):
+        """最初の1件を待ち、その後 flush_interval 秒の間に届いた分を batch_size 件までまとめる"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stopping.is_set():
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        attempts = 0
+        while True:
+            try:
+                self.write_batch(batch)
+                METRIC_EVENTS_WRITTEN.inc(len(batch), sink=self.name)
                 return
-            
-            # 現在のマッチ情報を作成
-            current_match = {
-                'match_id': match_id,
-                'player_name': player_name,
-                'champion': champion,
-                'game_type': game_type,
-                'url': main_url,
-                'timestamp': (datetime.now() + timedelta(hours=9)).timestamp()
+            except Exception as e:
+                attempts += 1
+                if self._stopping.is_set():
+                    logging.error("イベントを書き出せなかったため%d件を破棄します（%s）: %s", len(batch), self.name, e)
+                    METRIC_EVENTS_DROPPED.inc(len(batch), sink=self.name)
+                    return
+                delay = min(60, 2 ** attempts)
+                logging.warning("イベントの書き出しに失敗したため%d秒後に再送します（%s）: %s", delay, self.name, e)
+                self._stopping.wait(delay)
+
+class JsonlEventSink(EventSink):
+    """1行1イベントのJSONでファイルに追記する"""
+
+    name = 'jsonl'
+
+    def __init__(self, target, **options):
+        super().__init__(target, **options)
+        self._file = None
+
+    def write_batch(self, events):
+        if self._file is None:
+            Path(self.target).parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.target, 'a', encoding='utf-8')
+        self._file.write(''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class UnixSocketEventSink(EventSink):
+    """Unixドメインソケットで待ち受けている受信側へ、1行1イベントのJSONで送る（切断時は次の書き出しで再接続）"""
+
+    name = 'unix'
+
+    def __init__(self, target, **options):
+        super().__init__(target, **options)
+        self._socket = None
+
+    def write_batch(self, events):
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(EVENT_SINK_TIMEOUT)
+            try:
+                sock.connect(self.target)
+            except OSError:
+                sock.close()
+                raise
+            self._socket = sock
+        payload = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events).encode('utf-8')
+        try:
+            self._socket.sendall(payload)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+class SQLiteEventSink(EventSink):
+    """SQLiteの events テーブルに追記する（バッチごとに1トランザクション）"""
+
+    name = 'sqlite'
+
+    def __init__(self, target, **options):
+        super().__init__(target, **options)
+        self._conn = None
+
+    def write_batch(self, events):
+        if self._conn is None:
+            Path(self.target).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.target)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS events ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, type TEXT, replica TEXT, seq INTEGER, payload TEXT)'
+            )
+            self._conn = conn
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO events (ts, type, replica, seq, payload) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (event['ts'], event['type'], event['replica'], event['seq'], json.dumps(event, ensure_ascii=False))
+                    for event in events
+                ],
+            )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class HttpEventSink(EventSink):
+    """ローカルのHTTPエンドポイントへ、バッチをJSONの配列でPOSTする（2xx以外は再送）"""
+
+    name = 'http'
+
+    def __init__(self, target, **options):
+        super().__init__(target, **options)
+        self._session = None
+
+    def write_batch(self, events):
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        response = self._session.post(self.target, json=events, timeout=EVENT_SINK_TIMEOUT)
+        response.raise_for_status()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+EVENT_SINK_TYPES = {
+    sink.name: sink for sink in (JsonlEventSink, UnixSocketEventSink, SQLiteEventSink, HttpEventSink)
+}
+
+class DiscordSubscriber(EventSubscriber):
+    """通知するイベントを、これまでと同じDiscordのメッセージにして送信キューへ入れる
+
+    送信は DISCORD_DISPATCHER のスレッドが行うため、受け取ったその場で処理する
+    （同時に発行された試合開始のイベントは、これまでどおりカテゴリごとに1通にまとめる）。
+    """
+
+    name = 'discord'
+
+    def __init__(self):
+        types = {
+            'match_started', 'player_not_found', 'player_quarantined', 'player_error',
+            'circuit_opened', 'circuit_recovered',
+        }
+        if MATCH_END_NOTIFY:
+            types.add('match_ended')
+        super().__init__(types)
+
+    def deliver(self, events):
+        match_groups = {}
+        ended_matches = []
+        for event in events:
+            event_type = event['type']
+            if event_type == 'match_started':
+                match_groups[event['match_id']] = [
+                    {
+                        'player_name': player['player'], 'nickname': player['nickname'],
+                        'champion': player['champion'], 'game_type': event['game_type'], 'url': event['url'],
+                    }
+                    for player in event['players']
+                ]
+            elif event_type == 'match_ended':
+                ended_matches.append(event)
+            elif event_type == 'player_error':
+                send_error_notification(event['player'], event['error'])
+            elif event_type in ('player_not_found', 'player_quarantined') and event.get('notify', True):
+                self._send_not_found(event)
+            elif event_type == 'circuit_opened':
+                send_service_notification(
+                    f"⚠️ **エラー**: `{event['host']}` への接続が{event['failures']}回連続で失敗したため、"
+                    f"{event['reset_after']:.0f}秒間リクエストを停止します。\n{event['reason']}"
+                )
+            elif event_type == 'circuit_recovered':
+                send_service_notification(f"✅ `{event['host']}` への接続が回復しました。")
+        if match_groups:
+            send_discord_notification(match_groups)
+        if ended_matches:
+            send_match_ended_notification(ended_matches)
+
+    def _send_not_found(self, event):
+        player_name = event['player']
+        message = (
+            f"⚠️ **注意**: プレイヤー `{PLAYER_DICT.get(player_name) or player_name}` が存在しません。"
+            f"プレイヤー名を確認してください。"
+        )
+        if event['type'] == 'player_quarantined':
+            message += f"（{event['recheck_after'] / 3600:.0f}時間ごとに再確認します）"
+        DISCORD_DISPATCHER.enqueue(WEBHOOK_URLS[PLAYER_CATEGORIES.get(player_name, 'friend')], message)
+
+class EventBus:
+    """試合や状態の変化をイベントとして、Discordや各書き出し先などの購読者に配る
+
+    イベントは type・ts（Unix時刻）・replica・seq（プロセス内の通し番号）と、種類ごとの項目を持つ辞書。
+    """
+
+    def __init__(self, subscribers=()):
+        self.subscribers = list(subscribers)
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    @classmethod
+    def from_config(cls, spec, types=EVENT_TYPES, discord=EVENT_DISCORD):
+        sink_types = {item.strip() for item in types.split(',') if item.strip()}
+        subscribers = [DiscordSubscriber()] if discord else []
+        for item in spec.split(','):
+            kind, _, target = item.partition('=')
+            kind = kind.strip().lower()
+            if not kind:
+                continue
+            if kind not in EVENT_SINK_TYPES:
+                raise ValueError(f"EVENT_SINKS に不明な書き出し先があります: '{kind}'")
+            if not target.strip():
+                raise ValueError(f"EVENT_SINKS の '{kind}' に宛先がありません")
+            subscribers.append(EVENT_SINK_TYPES[kind](target.strip(), types=sink_types))
+        return cls(subscribers)
+
+    def wants(self, event_type):
+        """その種類のイベントを受け取る購読者がいるか（イベントを組み立てる前の確認用）"""
+        return any(subscriber.accepts(event_type) for subscriber in self.subscribers)
+
+    def event(self, event_type, **fields):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return {'type': event_type, 'ts': time.time(), 'replica': SHARD_REPLICA_ID, 'seq': seq, **fields}
+
+    def publish(self, event_type, **fields):
+        if self.wants(event_type):
+            self.publish_batch([self.event(event_type, **fields)])
+
+    def publish_batch(self, events):
+        """同時に発生したイベントをまとめて配る"""
+        for event in events:
+            METRIC_EVENTS_PUBLISHED.inc(type=event['type'])
+        for subscriber in self.subscribers:
+            selected = [event for event in events if subscriber.accepts(event['type'])]
+            if not selected:
+                continue
+            try:
+                subscriber.deliver(selected)
+            except Exception as e:
+                logging.error("イベントを配れませんでした（%s）: %s", subscriber.name, e)
+
+    def depth(self):
+        return sum(subscriber.depth() for subscriber in self.subscribers)
+
+EVENTS = EventBus.from_config(EVENT_SINKS)
+
+# グローバルセッションを作成
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため、リクエストを送らなかった"""
+
+class CircuitBreaker:
+    """ホストごとの連続失敗を数え、閾値を超えたら一定時間リクエストを遮断する"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """リクエストを送ってよいか（遮断時間の経過後は1件だけ試行を許可する）"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        """成功を記録する。遮断から復旧した場合はTrueを返す"""
+        with self._lock:
+            recovered = self.opened_at is not None
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+            return recovered
+
+    def record_failure(self):
+        """失敗を記録する。新たに遮断を開始した場合はTrueを返す"""
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None:
+                # 試行が失敗したら、遮断時間をやり直す
+                self.opened_at = time.monotonic()
+                self._probing = False
+                return False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+class DNSCache:
+    """名前解決の結果を一定時間キャッシュする
+
+    プロセス全体の socket.getaddrinfo は置き換えず、HttpClient の接続処理からだけ使う。
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def addresses(self, host, port, family=socket.AF_UNSPEC):
+        """接続先のIPアドレスを getaddrinfo の順に返す"""
+        key = (host, port, family)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        result = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def forget(self, host, port, family=socket.AF_UNSPEC):
+        """どのアドレスにも接続できなかった場合に、次回は名前解決し直す"""
+        with self._lock:
+            self._entries.pop((host, port, family), None)
+
+def _dns_cached_adapter(dns_cache, **kwargs):
+    """接続先の名前解決に dns_cache を使う requests のアダプタを作る"""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    from urllib3.util.connection import allowed_gai_family
+
+    class CachedDNSConnection:
+        # urllib3 は _dns_host を接続先として使う。host（SNIや証明書の検証に使う名前）はそのまま残す
+        def _new_conn(self):
+            name = self._dns_host
+            family = allowed_gai_family()
+            try:
+                addresses = dns_cache.addresses(name, self.port, family)
+            except socket.gaierror:
+                # 名前解決のエラーは urllib3 の例外にしてもらう
+                return super()._new_conn()
+            error = None
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (ConnectTimeoutError, NewConnectionError) as e:
+                    error = e
+                finally:
+                    self._dns_host = name
+            dns_cache.forget(name, self.port, family)
+            raise error
+
+    class CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = type('CachedDNSHTTPConnection', (CachedDNSConnection, HTTPConnection), {})
+
+    class CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = type('CachedDNSHTTPSConnection', (CachedDNSConnection, HTTPSConnection), {})
+
+    class CachedDNSAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': CachedDNSHTTPConnectionPool, 'https': CachedDNSHTTPSConnectionPool,
             }
-            
-            # プレイヤーの履歴を管理
-            if player_name not in last_match_info:
-                last_match_info[player_name] = []
-            
-            # 同じマッチがあるかチェック
-            for match in last_match_info[player_name]:
-                if match['match_id'] == current_match['match_id']:
-                    logging.info(f"同じマッチをプレイ中のため、通知をスキップします: {player_name} (Match ID: {match_id})")
+
+    return CachedDNSAdapter(**kwargs)
+
+def _dns_cached_backend(dns_cache):
+    """接続先の名前解決に dns_cache を使う httpcore のネットワークバックエンドを作る"""
+    import httpcore
+
+    class CachedDNSBackend(httpcore.SyncBackend):
+        # TLSのサーバー名には httpcore が元のホスト名を使うため、接続先だけIPアドレスにする
+        def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            error = None
+            for address in dns_cache.addresses(host, port):
+                try:
+                    return super().connect_tcp(address, port, timeout, local_address, socket_options)
+                except httpcore.ConnectError as e:
+                    error = e
+            dns_cache.forget(host, port)
+            raise error
+
+    return CachedDNSBackend()
+
+class _HttpxResponse:
+    """httpx のレスポンスを、stream_page が使う requests 互換の形に揃える"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = response.charset_encoding
+
+    def iter_content(self, chunk_size=None):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+class HttpClient:
+    """ワーカー間で共有する、接続を使い回すHTTPクライアント
+
+    接続プールはワーカー数に合わせ、スイープをまたいでkeep-aliveで再利用する。
+    リトライはスケジューラに任せ、1人分の枠の中では行わない。
+    """
+
+    def __init__(self, pool_size, http2=True):
+        self.pool_size = pool_size
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._session = None
+        self._httpx = None
+        self._breakers = {}
+        self.dns_cache = DNSCache(DNS_CACHE_TTL)
+
+    @property
+    def session(self):
+        # 複数のワーカーが同時に初期化しないようにロックする
+        with self._lock:
+            if self._session is None:
+                # requests の読み込みは重いため、最初のリクエストまで遅らせる
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                self._session = requests.Session()
+                adapter_options = {
+                    'max_retries': 0, 'pool_connections': self.pool_size, 'pool_maxsize': self.pool_size,
+                }
+                if self.dns_cache.ttl > 0:
+                    adapter = _dns_cached_adapter(self.dns_cache, **adapter_options)
+                else:
+                    adapter = HTTPAdapter(**adapter_options)
+                self._session.mount("http://", adapter)
+                self._session.mount("https://", adapter)
+                self._httpx = self._create_http2_client()
+        return self._session
+
+    def _create_http2_client(self):
+        if not self.http2:
+            return None
+        try:
+            import httpx
+            limits = httpx.Limits(
+                max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+            )
+            # h2 が入っていない場合は httpx が ImportError を送出する
+            transport = httpx.HTTPTransport(http2=True, limits=limits)
+        except ImportError:
+            return None
+        logging.info("HTTP/2 クライアントを使用します")
+        if self.dns_cache.ttl > 0:
+            # httpx には接続処理を差し替える公開の設定がないため、内部の接続プールに渡す。
+            # 内部の構成が変わっていた場合は、HTTP/2 の接続だけ名前解決のキャッシュを使わない
+            pool = getattr(transport, '_pool', None)
+            try:
+                if pool is None or not hasattr(pool, '_network_backend'):
+                    raise AttributeError("httpcore の接続プールが見つかりません")
+                pool._network_backend = _dns_cached_backend(self.dns_cache)
+            except (AttributeError, ImportError) as e:
+                logging.warning(f"HTTP/2 クライアントでは名前解決のキャッシュを使用しません: {str(e)}")
+        return httpx.Client(transport=transport)
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+                self._breakers[host] = breaker
+            return breaker
+
+    def open_circuits(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return sum(1 for breaker in breakers if breaker.is_open)
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        """GETリクエストを送る。ホストの遮断中は CircuitOpenError を送出する"""
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{host} への接続を一時的に停止しています")
+
+        session = self.session
+        try:
+            if self._httpx is not None:
+                request = self._httpx.build_request('GET', url, headers=headers, timeout=timeout)
+                response = _HttpxResponse(self._httpx.send(request, stream=stream))
+            else:
+                response = session.get(url, headers=headers, timeout=timeout, stream=stream)
+        except Exception as e:
+            self._record_failure(host, breaker, str(e))
+            raise
+
+        if response is not None and (response.status_code >= 500 or response.status_code == 429):
+            self._record_failure(host, breaker, f"HTTP {response.status_code}")
+        elif breaker.record_success():
+            logging.info(f"{host} への接続が回復しました")
+            EVENTS.publish('circuit_recovered', host=host)
+        return response
+
+    def _record_failure(self, host, breaker, reason):
+        if breaker.record_failure():
+            # プレイヤーごとではなく、遮断を開始したときに1回だけ通知する
+            logging.error(f"{host} への接続を {CIRCUIT_RESET_TIMEOUT:.0f}秒間停止します: {reason}")
+            EVENTS.publish(
+                'circuit_opened', host=host, failures=breaker.failures, reset_after=CIRCUIT_RESET_TIMEOUT, reason=reason
+            )
+
+HTTP_CLIENT = HttpClient(POLL_WORKERS, HTTP2_ENABLED)
+
+# グローバル変数として追加
+not_found_player_notifications = {}  # {player_name: last_notification_time}
+
+def get_player_webhook_url(player_name):
+    """プレイヤーのカテゴリに基づいてWebhook URLを取得"""
+    category = PLAYER_CATEGORIES.get(player_name, 'friend')
+    return WEBHOOK_URLS.get(category, '')
+
+def send_service_notification(message):
+    """プレイヤーに依存しない障害通知を、設定されている各Webhookに1回ずつ送信"""
+    for webhook_url in dict.fromkeys(url for url in WEBHOOK_URLS.values() if url):
+        DISCORD_DISPATCHER.enqueue(webhook_url, message)
+
+def send_error_notification(player_name, error_message):
+    """エラーノーティフィケーションを送信"""
+    webhook_url = get_player_webhook_url(player_name)
+    if webhook_url:
+        DISCORD_DISPATCHER.enqueue(
+            webhook_url,
+            f"⚠️ **エラー**: `{PLAYER_DICT[player_name]}` (`{player_name}`) の情報取得中にエラーが発生しました。\n{error_message}"
+        )
+
+# ページ分類のマーカー（小文字化した本文のバイト列に対して照合する）。判定の優先順に並べている
+_MARKERS = (
+    ('not_found', (b'summoner not found', b'404 - page not found', b'summoner-not-found', b'the summoner does not exist')),
+    ('loading', (b"damn, that's pretty slow to load", b'loadmessage', b'spinner')),
+    ('in_game', (b'live-game-stats', b'team stats', b'game-status-ingame', b'live game', b'spectate')),
+    # 'the summoner is not in-game' は 'not in-game' を含むため照合しない
+    ('not_in_game', (b'summoner-offline', b'not in-game', b'please retry later', b'must be on the loading screen')),
+)
+# チャンク境界をまたぐマーカーのため、前回探索した範囲の末尾からこの長さだけ戻って探す
+_MARKER_OVERLAP = max(len(marker) for _, markers in _MARKERS for marker in markers) - 1
+
+GAME_TYPE_MAPPING = {
+    'ranked solo/duo': 'RANKED SOLO/DUO',
+    'ranked flex': 'RANKED FLEX',
+    'normal (quickplay)': 'NORMAL',
+    'aram': 'ARAM',
+    'arena': 'ARENA',
+    'arurf 4v4': 'CUSTOM',
+}
+
+# 抽出に使うトークン
+_RESULT_TD = b'class="resulttd"'
+_MATCH_HREF = b'href="https://www.leagueofgraphs.com/match/'
+_GAME_TYPE_H2 = b'<h2 class="left relative">'
+_CARD = b'<div class="card card-5" data-summonername="'
+# カード内でチャンピオン名にたどり着くまでに順に現れるトークン（championboxは2通りの書き方がある）
+_CHAMPION_CHAIN = (
+    (b'<div class="box championbox', b'class="championbox'),
+    (b'<div class="imgflex',),
+    (b'<div class="imgcolumn-champion',),
+    (b'<div class="relative requiretooltip',),
+    (b'tooltip="',),
+    (b'alt="',),
+)
+# トークンと値の最大長。チャンク境界をまたぐトークンのため、この長さだけ末尾を次のチャンクに持ち越す
+_SCAN_LOOKAHEAD = 600
+
+def _decode_value(value):
+    return value.decode('utf-8', errors='replace')
+
+class PageScanner:
+    """porofessorのページ（UTF-8のバイト列）を先頭から1回だけ走査して分類・抽出するスキャナ"""
+
+    # チャンク単位で投入でき、保持するのは小文字化したチャンクと持ち越し分の末尾だけなのでページ全体のコピーは作らない。
+    # 各マーカー・トークンの探索は前回の終端から再開し、同じ範囲を探し直さない。
+    # 文字列へのデコードは、抽出した値（カードの名前・チャンピオン名など）にだけ行う。
+
+    def __init__(self, player_names=()):
+        self.not_found = False
+        self.loading = False
+        self.in_game = False
+        self.not_in_game = False
+        self.match_id = None
+        self.game_type = None
+        self.champions = {}  # 監視対象のdata-summonername（小文字） -> チャンピオン名
+        self.bytes_scanned = 0
+        self.peak_buffer = 0
+        self.classify_seconds = 0.0
+        self.extract_seconds = 0.0
+        # チャンピオン名が必要なプレイヤー（小文字）
+        self._wanted = {name.lower() for name in player_names}
+        self._buf = b''
+        self._classified = 0  # 分類のマーカーを探し終えたバッファ上の位置
+        self._seen_result_td = False
+        self._match_pos = 0
+        self._game_type_pos = 0
+        self._card_pos = 0
+        self._card = None
+        self._chain_step = 0
+        self._closed = False
+
+    def feed(self, chunk):
+        """チャンク（UTF-8のバイト列）を投入する"""
+        self.bytes_scanned += len(chunk)
+        self._buf += chunk.lower()
+        self.peak_buffer = max(self.peak_buffer, len(self._buf))
+        self._scan(final=False)
+
+    def close(self):
+        """残りのバッファを処理して走査を終える"""
+        if not self._closed:
+            self._closed = True
+            self._scan(final=True)
+            self._buf = b''
+        return self
+
+    def _scan(self, final):
+        buf = self._buf
+        # limitより前で始まるトークンは値まで含めてバッファに揃っているので確定できる
+        limit = len(buf) if final else len(buf) - _SCAN_LOOKAHEAD
+        if limit <= 0:
+            return
+        started = time.perf_counter()
+        self._classify(buf)
+        classified = time.perf_counter()
+        self._extract_match_id(buf, limit)
+        self._extract_game_type(buf, limit)
+        self._extract_champions(buf, limit, final)
+        self.classify_seconds += classified - started
+        self.extract_seconds += time.perf_counter() - classified
+        if not final:
+            # 持ち越す末尾に合わせて各カーソルをずらす
+            self._buf = buf[limit:]
+            self._classified -= limit
+            self._match_pos = max(self._match_pos - limit, 0)
+            self._game_type_pos = max(self._game_type_pos - limit, 0)
+            self._card_pos = max(self._card_pos - limit, 0)
+
+    def _classify(self, buf):
+        start = max(self._classified - _MARKER_OVERLAP, 0)
+        self._classified = len(buf)
+        for attr, markers in _MARKERS:
+            # 「存在しない」が優先されるため、見つかった後は他の分類を探さない
+            if self.not_found:
+                return
+            # 見つかった分類と、「試合中」が見つかった後の「試合中でない」は探さない
+            if getattr(self, attr) or (attr == 'not_in_game' and self.in_game):
+                continue
+            for marker in markers:
+                if buf.find(marker, start) != -1:
+                    setattr(self, attr, True)
+                    break
+
+    def _extract_match_id(self, buf, limit):
+        if self.match_id is not None:
+            return
+        if not self._seen_result_td:
+            pos = buf.find(_RESULT_TD, self._match_pos, limit + len(_RESULT_TD))
+            if pos == -1:
+                self._match_pos = limit
+                return
+            self._seen_result_td = True
+            self._match_pos = pos
+        pos = buf.find(_MATCH_HREF, self._match_pos, limit + len(_MATCH_HREF))
+        if pos == -1:
+            self._match_pos = limit
+            return
+        start = pos + len(_MATCH_HREF)
+        end = buf.find(b'#', start, start + _SCAN_LOOKAHEAD - len(_MATCH_HREF))
+        if end != -1:
+            # /match/{地域}/{マッチID} の地域部分を除く
+            self.match_id = _decode_value(buf[start:end].rpartition(b'/')[2])
+        self._match_pos = start
+
+    def _extract_game_type(self, buf, limit):
+        if self.game_type is not None:
+            return
+        pos = buf.find(_GAME_TYPE_H2, self._game_type_pos, limit + len(_GAME_TYPE_H2))
+        if pos == -1:
+            self._game_type_pos = limit
+            return
+        end = buf.find(b'</h2>', pos, pos + _SCAN_LOOKAHEAD)
+        if end == -1:
+            self.game_type = "不明"
+            return
+        lines = buf[pos:end].split(b'\n')
+        self.game_type = GAME_TYPE_MAPPING.get(_decode_value(lines[1].strip()), "不明") if len(lines) > 1 else "不明"
+
+    def _extract_champions(self, buf, limit, final):
+        pos = self._card_pos
+        while True:
+            if self._card is None:
+                card_start = buf.find(_CARD, pos, limit + len(_CARD))
+                if card_start == -1:
+                    self._card_pos = limit
                     return
-            
-            # 新しいマッチを追加
-            last_match_info[player_name].append(current_match)
-            
-            # 2マッチを超え場合、最も古いマッチを削除
-            if len(last_match_info[player_name]) > MAX_MATCHES_PER_PLAYER:
-                # タイムスタンプで並び替えて古いものを削除
-                last_match_info[player_name].sort(key=lambda x: x['timestamp'], reverse=True)
-                last_match_info[player_name] = last_match_info[player_name][:MAX_MATCHES_PER_PLAYER]
-            
-            logging.info(f'判定結果: 試合中です（{game_type}）- {champion}')
-            return current_match  # マッチ情報を返すのみ
-
-        # 試合中ではない場合��判定
-        not_in_game_patterns = [
-            'the summoner is not in-game',
-            'summoner-offline',
-            'not in-game',
-            'please retry later',
-            'must be on the loading screen'
-        ]
-        if any(pattern in content for pattern in not_in_game_patterns):
-            print('判定結果: プレイヤーは試合中ではありません')
-            return None  # 試合中でない場合はNoneを返す
+                name_start = card_start + len(_CARD)
+                name_end = buf.find(b'"', name_start, name_start + 100)
+                if name_end == -1:
+                    pos = name_start
+                    continue
+                pos = name_end
+                # バイト列の小文字化はASCIIだけなので、デコードしてから小文字にする
+                card = _decode_value(buf[name_start:name_end]).lower()
+                # チャンピオン名をたどるのは、チェック中のプレイヤーと名簿にいるプレイヤーのカードだけ
+                if card not in self._wanted and card not in TRACKED_PLAYERS_BY_CARD:
+                    continue
+                self._card = card
+                self._chain_step = 0
+            # 次のカードより前にあるトークンだけを、このカードのものとして扱う
+            next_card = buf.find(_CARD, pos, limit + len(_CARD))
+            bound = next_card if next_card != -1 else limit
+            while self._chain_step < len(_CHAMPION_CHAIN):
+                found = -1
+                for token in _CHAMPION_CHAIN[self._chain_step]:
+                    found = buf.find(token, pos, bound + len(token))
+                    if found != -1:
+                        break
+                if found == -1 or found >= bound:
+                    break
+                pos = found + len(token)
+                self._chain_step += 1
+            if self._chain_step == len(_CHAMPION_CHAIN):
+                alt_end = buf.find(b'"', pos, pos + 100)
+                if alt_end != -1:
+                    self.champions.setdefault(self._card, _decode_value(buf[pos:alt_end]).capitalize())
+                self._card = None
+                continue
+            if next_card == -1:
+                # カードの途中でバッファが尽きたので次のチャンクを待つ
+                self._card_pos = max(pos, limit) if not final else limit
+                return
+            # チャンピオン名が見つからないままカードが終わった
+            self._card = None
+            pos = next_card
+
+    @property
+    def outcome(self):
+        """従来の判定順（存在しない→ローディング→試合中→試合中でない）で分類する"""
+        if self.not_found:
+            return 'not_found'
+        if self.loading:
+            return 'loading'
+        if self.in_game:
+            return 'in_game'
+        if self.not_in_game:
+            return 'offline'
+        return 'unknown'
+
+    @property
+    def decided(self):
+        """ページの残りを読まなくても結果が確定しているか
+
+        outcome と同じ優先順位で、より上位のマーカーが後から現れる可能性がない場合だけ確定とする。
+        マーカーはページのどこにでも現れうる（以降に上位のマーカーが現れないと言える構造上の区切りがない）ため、
+        試合中・ローディング・試合中でないページでは打ち切らず、最上位の「存在しない」だけで確定とする。
+        それ以外のページの読み込み量は STREAM_MAX_BYTES と PLAYER_CHECK_TIMEOUT で抑える。
+        """
+        return self.not_found
+
+    def champion_for(self, player_name):
+        """プレイヤーのカードから抽出したチャンピオン名"""
+        return self.champions.get(player_name.lower(), "不明")
+
+def scan_page(content, chunk_size=None, player_names=(), stop_early=False):
+    """ページ全体（またはchunk_sizeごとに分割したもの）を走査する（文字列はUTF-8にして渡す）"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    scanner = PageScanner(player_names)
+    if chunk_size:
+        for i in range(0, len(content), chunk_size):
+            scanner.feed(content[i:i + chunk_size])
+            if stop_early and scanner.decided:
+                break
+    else:
+        scanner.feed(content)
+    return scanner.close()
+
+class FetchedPage:
+    """ストリーミング取得の結果"""
+
+    def __init__(self, scanner, status_code, preview, content, bytes_read, early_stopped, truncated, parse_seconds,
+                 decode_seconds=0.0):
+        self.scanner = scanner
+        self.status_code = status_code
+        self.preview = preview          # 先頭500文字（状態を特定できなかった場合の調査用）
+        self.content = content          # SAVE_HTML_LOG が有効な場合のみ保持する本文
+        self.bytes_read = bytes_read
+        self.early_stopped = early_stopped
+        self.truncated = truncated
+        self.parse_seconds = parse_seconds
+        self.decode_seconds = decode_seconds
+
+class ResponseCache:
+    """条件付きリクエスト用のETag/Last-Modifiedと、プレイヤーごとの短期の判定結果を保持する"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._validators = OrderedDict()  # URL -> (ETag, Last-Modified, 前回の解析結果)
+        self._results = OrderedDict()     # プレイヤー名 -> (有効期限, 判定結果)
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        # 古いものから追い出して件数の上限を守る
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def conditional_headers(self, url, headers):
+        """前回の応答に検証子があれば、条件付きリクエストのヘッダーを付ける"""
+        with self._lock:
+            entry = self._validators.get(url)
+        if entry is None:
+            return headers
+        etag, last_modified, _ = entry
+        headers = dict(headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def not_modified(self, url):
+        """304応答のときに使う、前回の解析結果"""
+        with self._lock:
+            entry = self._validators.get(url)
+            if entry is None:
+                return None
+            self._validators.move_to_end(url)
+            return entry[2]
+
+    def store_page(self, url, response_headers, page):
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        # 検証子がない、または上限で打ち切ったページは再利用しない
+        if not (etag or last_modified) or page.truncated:
+            return
+        cached = FetchedPage(
+            page.scanner, 304, page.preview, None, 0, False, False, 0.0
+        )
+        with self._lock:
+            self._put(self._validators, url, (etag, last_modified, cached))
+
+    def get_result(self, player_name):
+        """有効期限内の判定結果（offline / not_found）を返す"""
+        with self._lock:
+            entry = self._results.get(player_name)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._results[player_name]
+                return None
+            return entry[1]
+
+    def store_result(self, player_name, outcome):
+        ttl = {'offline': RESULT_CACHE_TTL, 'not_found': NOT_FOUND_CACHE_TTL}.get(outcome, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._put(self._results, player_name, (time.monotonic() + ttl, outcome))
+
+    def forget(self, player_name):
+        with self._lock:
+            self._results.pop(player_name, None)
+
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+
+def _throttle(rate_limiter):
+    """レート制限のトークンを取得し、待った時間を throttle に加算して返す"""
+    if rate_limiter is None:
+        return 0.0
+    throttle_started = time.monotonic()
+    rate_limiter.acquire()
+    waited = time.monotonic() - throttle_started
+    STAGE_TIMERS.add('throttle', waited)
+    return waited
+
+def stream_page(client, url, headers, player_name, rate_limiter=RATE_LIMITER):
+    """ページをストリーミングで取得しながら走査し、存在しないと分かった時点か読み込みの上限で接続を閉じる"""
+    _throttle(rate_limiter)
+    started = time.monotonic()
+    reused = False
+    try:
+        response = client.get(
+            url, headers=RESPONSE_CACHE.conditional_headers(url, headers),
+            timeout=PLAYER_CHECK_TIMEOUT, stream=True
+        )
+        if response is None:
+            return None
+        STARTUP.mark_first_request()
+        page = None
+        if response.status_code == 304:
+            response.close()
+            page = RESPONSE_CACHE.not_modified(url)
+            if page is None:
+                # 前回の解析結果が追い出されていた場合は条件なしで取得し直す（これも1回のリクエストとして数える）
+                # 待った時間は取得時間に含めない
+                started += _throttle(rate_limiter)
+                response = client.get(url, headers=headers, timeout=PLAYER_CHECK_TIMEOUT, stream=True)
+            else:
+                METRIC_CACHE_HITS.inc(kind='not_modified')
+                reused = True
+        if page is None:
+            page = _read_streamed_page(response, player_name, started)
+            RESPONSE_CACHE.store_page(url, response.headers, page)
+    except Exception:
+        METRIC_FETCH_SECONDS.observe(time.monotonic() - started, outcome='error')
+        raise
+
+    elapsed = time.monotonic() - started
+    FETCH_STATS.record(page)
+    METRIC_FETCH_SECONDS.observe(elapsed, outcome=page.scanner.outcome)
+    if reused:
+        # 304で前回の解析結果を使った場合は、デコードと走査をしていない
+        STAGE_TIMERS.add('fetch', elapsed)
+    else:
+        METRIC_PARSE_SECONDS.observe(page.parse_seconds)
+        STAGE_TIMERS.add_page(page, elapsed)
+    return page
+
+def _read_streamed_page(response, player_name, started):
+    """レスポンス本文をチャンクごとに読み、PageScannerに投入する"""
+
+    scanner = PageScanner((player_name,))
+    # charsetの指定がない場合、requestsはISO-8859-1とみなすため、UTF-8で読む
+    content_type = response.headers.get('Content-Type', '').lower()
+    encoding = response.encoding if 'charset=' in content_type and response.encoding else 'utf-8'
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    # スキャナはUTF-8のバイト列をそのまま走査する。デコードするのは先頭の500文字と、他の文字コードのページだけ
+    transcode = codecs.lookup(encoding).name != 'utf-8'
+    captured = [] if SAVE_HTML_LOG else None
+    preview = ''
+    bytes_read = 0
+    parse_seconds = 0.0
+    decode_seconds = 0.0
+    early_stopped = False
+    truncated = False
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            bytes_read += len(chunk)
+            decode_started = time.perf_counter()
+            if transcode or len(preview) < 500:
+                text = decoder.decode(chunk)
+                preview += text[:500 - len(preview)]
+                if transcode:
+                    chunk = text.encode('utf-8')
+            decode_seconds += time.perf_counter() - decode_started
+            if captured is not None:
+                captured.append(chunk)
+            parse_started = time.perf_counter()
+            scanner.feed(chunk)
+            parse_seconds += time.perf_counter() - parse_started
+            # HTMLログを保存する場合は、本文を切り詰めないよう最後まで読む
+            if scanner.decided and captured is None:
+                early_stopped = True
+                break
+            # 読み込み量と所要時間に上限を設け、1回のチェックのコストを抑える
+            if bytes_read >= STREAM_MAX_BYTES or time.monotonic() - started > PLAYER_CHECK_TIMEOUT:
+                truncated = True
+                break
         else:
-            # ゲーム中でない場合の処理
-            if player_name in last_match_info:
-                # 最新の5マッチは保持
-                matches = last_match_info[player_name]
-                if matches:
-                    matches.sort(key=lambda x: x['timestamp'], reverse=True)
-                    last_match_info[player_name] = matches[:MAX_MATCHES_PER_PLAYER]
-        print('レスポンスステータス:', response.status_code)
-        print('レスポンス内容の一部:', content[:500])
-        print('判定結果: 状態を特定できません')
+            if transcode:
+                tail = decoder.decode(b'', final=True).encode('utf-8')
+                if captured is not None:
+                    captured.append(tail)
+                scanner.feed(tail)
+    finally:
+        # 途中で打ち切った場合は残りを読まずに接続を閉じる
+        response.close()
+    parse_started = time.perf_counter()
+    scanner.close()
+    parse_seconds += time.perf_counter() - parse_started
+
+    content = None
+    if captured is not None:
+        decode_started = time.perf_counter()
+        content = b''.join(captured).decode('utf-8', errors='replace')
+        decode_seconds += time.perf_counter() - decode_started
+    return FetchedPage(
+        scanner, response.status_code, preview, content,
+        bytes_read, early_stopped, truncated, parse_seconds, decode_seconds
+    )
+
+_BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'ja,en-US;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Cache-Control': 'no-cache'
+}
+
+class LiveGameProvider:
+    """porofessorと同じ形式のライブページを返す取得元"""
+
+    name = None
+    default_base_url = None
+
+    def __init__(self, base_url=None, rate_limiter=None):
+        self.base_url = (base_url or self.default_base_url).rstrip('/')
+        self.host = urlsplit(self.base_url).netloc
+        self.rate_limiter = rate_limiter
+        self.headers = dict(_BROWSER_HEADERS, Referer=f'{self.base_url}/')
+
+    def live_url(self, player_name, region):
+        return f"{self.base_url}/live/{region}/{player_name.replace('#', '-')}"
+
+    def partial_url(self, player_name, region):
+        """ローディング中に呼び出すAPIエンドポイント"""
+        return f"{self.base_url}/partial/live-partial/{region}/{player_name.replace('#', '-')}"
+
+class PorofessorProvider(LiveGameProvider):
+    """porofessor.gg（POROFESSOR_RATE_LIMIT で送信間隔を制限する）"""
+
+    name = 'porofessor'
+    default_base_url = POROFESSOR_BASE_URL
+
+    def __init__(self, base_url=None):
+        super().__init__(base_url, RATE_LIMITER)
+
+class MockProvider(LiveGameProvider):
+    """保存済みページを返すローカルサーバー（benchmarks/replay.py --serve）"""
+
+    name = 'mock'
+    default_base_url = 'http://127.0.0.1:8081'
+
+PROVIDER_TYPES = {provider.name: provider for provider in (PorofessorProvider, MockProvider)}
+
+class ProviderStats:
+    """取得元ごとのレイテンシと成功率の指数移動平均"""
+
+    def __init__(self, alpha=PROVIDER_STATS_ALPHA, initial_latency=1.0):
+        self.alpha = alpha
+        self.latency = initial_latency
+        self.success_rate = 1.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.latency += self.alpha * (seconds - self.latency)
+            self.success_rate += self.alpha * ((1.0 if ok else 0.0) - self.success_rate)
+            self.samples += 1
+
+    def score(self):
+        """成功するまでの期待所要時間。小さいほど優先する"""
+        return self.latency / max(self.success_rate, 0.05)
+
+class ProviderSet:
+    """成績の良い取得元から順に問い合わせ、失敗したら次の取得元へ、遅ければ次の取得元にも並行して問い合わせる"""
+
+    def __init__(self, providers, hedge_delay=PROVIDER_HEDGE_DELAY):
+        if not providers:
+            raise ValueError("LIVE_PROVIDERS に取得元が設定されていません。")
+        self.providers = providers
+        self.hedge_delay = hedge_delay
+        self.stats = {provider: ProviderStats() for provider in providers}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, spec):
+        providers = []
+        for item in spec.split(','):
+            kind, _, base_url = item.partition('=')
+            kind = kind.strip().lower()
+            if not kind:
+                continue
+            if kind not in PROVIDER_TYPES:
+                raise ValueError(f"LIVE_PROVIDERS に不明な取得元があります: '{kind}'")
+            providers.append(PROVIDER_TYPES[kind](base_url.strip() or None))
+        return cls(providers)
+
+    @property
+    def primary(self):
+        """通知に載せるリンクの取得元（設定の先頭）"""
+        return self.providers[0]
+
+    def circuit_open(self):
+        return any(HTTP_CLIENT.breaker(provider.host).is_open for provider in self.providers)
+
+    def ranked(self):
+        """遮断中でない取得元を、期待所要時間の短い順に並べる"""
+        ranked = sorted(
+            self.providers,
+            key=lambda provider: (HTTP_CLIENT.breaker(provider.host).is_open, self.stats[provider].score())
+        )
+        if len(ranked) > 1 and random.random() < PROVIDER_EXPLORE_RATE:
+            ranked[0], ranked[1] = ranked[1], ranked[0]
+        return ranked
+
+    def fetch(self, player_name, region, partial=False):
+        """(取得元, ページ) を返す。全ての取得元が例外で失敗した場合は最後の例外を送出する"""
+        waiting = self.ranked()
+        if len(waiting) == 1:
+            return waiting[0], self._fetch(waiting[0], player_name, region, partial)
+
+        executor = self._get_executor()
+        pending = {}
+        last_page = last_error = None
+        while waiting or pending:
+            if not pending:
+                # 問い合わせ中の取得元がなければ、次の取得元に切り替える
+                provider = waiting.pop(0)
+                pending[executor.submit(PROFILER.wrap(self._fetch), provider, player_name, region, partial)] = provider
+            timeout = self.hedge_delay if waiting and self.hedge_delay > 0 else None
+            done, _ = concurrent.futures.wait(pending, timeout, concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                # 遅延の予算を超えたため、次の取得元にも問い合わせて早い方を使う
+                provider = waiting.pop(0)
+                METRIC_PROVIDER_HEDGES.inc(provider=provider.name)
+                logging.info(
+                    "応答が%.1f秒を超えたため、%s にも問い合わせます: %s", self.hedge_delay, provider.name, player_name,
+                    extra={'player': player_name, 'provider': provider.name}
+                )
+                pending[executor.submit(PROFILER.wrap(self._fetch), provider, player_name, region, partial)] = provider
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    page = future.result()
+                except Exception as e:
+                    logging.warning(
+                        "%s からの取得に失敗しました: %s: %s", provider.name, player_name, e,
+                        extra={'player': player_name, 'provider': provider.name}
+                    )
+                    last_error = e
+                    continue
+                if self._usable(page):
+                    # 残りの問い合わせは結果を待たない（統計は完了時に記録される）
+                    for other in pending:
+                        other.cancel()
+                    return provider, page
+                last_page = (provider, page)
+        if last_page is not None:
+            return last_page
+        raise last_error
+
+    @staticmethod
+    def _usable(page):
+        return page is not None and page.scanner.outcome != 'unknown'
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=POLL_WORKERS * len(self.providers), thread_name_prefix='provider'
+                )
+            return self._executor
+
+    def _fetch(self, provider, player_name, region, partial):
+        url = provider.partial_url(player_name, region) if partial else provider.live_url(player_name, region)
+        started = time.monotonic()
+        ok = False
+        page = None
+        try:
+            page = stream_page(HTTP_CLIENT, url, provider.headers, player_name, provider.rate_limiter)
+            ok = self._usable(page)
+            return page
+        finally:
+            elapsed = time.monotonic() - started
+            if page is not None and logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(
+                    "取得: %s %s (%s, %.3f秒, %dバイト)", provider.name, url, page.scanner.outcome, elapsed,
+                    page.bytes_read, extra={
+                        'player': player_name, 'provider': provider.name, 'url': url, 'outcome': page.scanner.outcome,
+                        'latency': round(elapsed, 4), 'bytes': page.bytes_read, 'status': page.status_code, **SAMPLED
+                    }
+                )
+            stats = self.stats[provider]
+            stats.record(elapsed, ok)
+            METRIC_PROVIDER_REQUESTS.inc(provider=provider.name, outcome='ok' if ok else 'failed')
+            METRIC_PROVIDER_LATENCY.set(round(stats.latency, 4), provider=provider.name)
+            METRIC_PROVIDER_SUCCESS.set(round(stats.success_rate, 4), provider=provider.name)
+
+PROVIDERS = ProviderSet.from_config(LIVE_PROVIDERS)
+
+def live_page_url(player_name):
+    """通知に載せるプレイヤーのライブページURL"""
+    return PROVIDERS.primary.live_url(player_name, PLAYER_REGIONS.get(player_name, DEFAULT_REGION))
+
+def register_match(player_name, match_id, champion, game_type, url, loading=False):
+    """マッチ情報を履歴に登録する（同じマッチが登録済みの場合はNone）"""
+    player_last_status[player_name] = 'in_game'
+    MATCH_LIFECYCLE.observe(match_id, player_name, champion, game_type, url, loading)
+    record = MatchRecord(match_id, player_name, champion, game_type, url, time.time())
+    # 同じマッチが登録済みかは索引からO(1)で判定する
+    if not MATCH_INDEX.add(record):
+        logging.info(
+            "同じマッチをプレイ中のため、通知をスキップします: %s (Match ID: %s)", player_name, match_id,
+            extra={'player': player_name, 'match_id': match_id, **SAMPLED}
+        )
+        return None
+
+    PLAYER_STATS.record_game(player_name, game_type, champion, record.timestamp)
+    STATE_STORE.mark_match(player_name)
+    return record.as_dict()
+
+def resolve_teammates(scanner, player_name, sweep, loading=False):
+    """取得済みのライブページに載っている他の監視対象プレイヤーを、同じマッチとして登録する
+
+    他のレプリカが担当するプレイヤーは登録せず、通知の参加者としてだけ sweep に記録する。
+    """
+    page_players = {}
+    for card_name, champion in scanner.champions.items():
+        teammate = TRACKED_PLAYERS_BY_CARD.get(card_name)
+        if teammate is None or champion == "不明" or ROSTER_VALIDATOR.is_quarantined(teammate):
+            continue
+        page_players[teammate] = champion
+        # 他のレプリカが担当するプレイヤーは登録しない
+        if teammate == player_name or not CLUSTER.owns(teammate):
+            continue
+        # 既にこのスイープでチェック済み（またはチェック中）のプレイヤーは対象外
+        if not sweep.claim(teammate):
+            continue
+        result = register_match(
+            teammate, scanner.match_id, champion, scanner.game_type or "不明", live_page_url(teammate), loading
+        )
+        sweep.add_shared_result(teammate, result)
+        logging.info(
+            "同じページから解決しました: %s (Match ID: %s) - %s", teammate, scanner.match_id, champion,
+            extra={'player': teammate, 'match_id': scanner.match_id, **SAMPLED}
+        )
+    sweep.add_page_players(scanner.match_id, page_players)
+
+def fetch_partial_page(player_name, region):
+    """ローディング中のプレイヤーについて、APIエンドポイント（live-partial）を取得する"""
+    _, page = PROVIDERS.fetch(player_name, region, partial=True)
+    if page is None:
+        raise ValueError("live-partialのレスポンスがNoneです")
+    # APIレスポンスのHTMLログも保存
+    if page.content is not None:
+        save_html_log(f"{player_name}_api", page.content, page.scanner.outcome, page.truncated)
+    return page
+
+def _check_log_fields(page, started):
+    """チェック結果のログに付ける、取得開始からの所要時間と読み込んだバイト数"""
+    return {'latency': round(time.monotonic() - started, 4), 'bytes': page.bytes_read}
+
+def evaluate_page(player_name, scanner, status_code, content_preview, main_url, sweep, loading, log_fields=None):
+    """走査済みのページから試合状態を判定し、新しいマッチ情報を返す"""
+    log_fields = log_fields or {}
+    # 試合中の判定
+    if scanner.in_game:
+        # マッチIDやチャンピオンが取れなかった場合は状態不明として扱う
+        player_last_status[player_name] = 'unknown'
+
+        # マッチIDの取得
+        match_id = scanner.match_id
+        if not match_id:
+            logging.warning("マッチIDの取得に失敗しました: %s", player_name, extra={'player': player_name})
+            return
+
+        # 試合タイプの判定
+        game_type = scanner.game_type or "不明"
+
+        # 同じページに載っている他の監視対象プレイヤーもまとめて解決する
+        if sweep is not None:
+            resolve_teammates(scanner, player_name, sweep, loading)
+
+        # チャンピオンの判定
+        champion = scanner.champion_for(player_name)
+        if champion == "不明":
+            return
+        
+        current_match = register_match(player_name, match_id, champion, game_type, main_url, loading)
+        if current_match is None:
+            return
         
+        logging.info(
+            "判定結果: 試合中です（%s）- %s: %s", game_type, champion, player_name,
+            extra={'player': player_name, 'outcome': 'in_game', 'match_id': match_id, **log_fields}
+        )
+        return current_match  # マッチ情報を返すのみ
+
+    # 試合中ではない場合の判定
+    if scanner.not_in_game:
+        logging.info(
+            "判定結果: プレイヤーは試合中ではありません: %s", player_name,
+            extra={'player': player_name, 'outcome': 'offline', **log_fields, **SAMPLED}
+        )
+        player_last_status[player_name] = 'offline'
+        MATCH_LIFECYCLE.player_left(player_name)
+        RESPONSE_CACHE.store_result(player_name, 'offline')
+        return None  # 試合中でない場合はNoneを返す
+    else:
+        player_last_status[player_name] = 'unknown'
+    logging.warning(
+        "判定結果: 状態を特定できません: %s (ステータス %s)", player_name, status_code,
+        extra={'player': player_name, 'outcome': 'unknown', 'status': status_code, **log_fields}
+    )
+    # レスポンスの先頭はDEBUGのときだけ出力する
+    logging.debug("レスポンス内容の一部: %s", content_preview, extra={'player': player_name})
+
+def check_partial_status(player_name, attempt, sweep):
+    """ローディング中だったプレイヤーのlive-partialを取得し、{プレイヤー: 結果} を返す"""
+    region = PLAYER_REGIONS.get(player_name, DEFAULT_REGION)
+    try:
+        started = time.monotonic()
+        page = fetch_partial_page(player_name, region)
+        scanner = page.scanner
+        if not scanner.in_game and not scanner.not_in_game and attempt < PARTIAL_MAX_ATTEMPTS:
+            # まだ状態が分からない場合は、回数の上限まで間隔を空けて取得し直す
+            sweep.defer_partial(player_name, attempt + 1)
+            return {}
+        return {player_name: evaluate_page(
+            player_name, scanner, page.status_code, page.preview, live_page_url(player_name), sweep, loading=True,
+            log_fields=_check_log_fields(page, started)
+        )}
     except Exception as e:
-        error_message = f"プレイヤー名が間違っている可能性があります。確認をお願いします。\nエラー詳細: {str(e)}"
-        send_error_notification(player_name, error_message)
-        print(f'エラーが発生しました: {str(e)}')
-        return "error"
+        # 最初のページは取得できているため、プレイヤーごとのエラー通知は送らない
+        logging.warning(
+            "live-partialの取得に失敗しました: %s (%d回目): %s", player_name, attempt, e, extra={'player': player_name}
+        )
+        player_last_status[player_name] = 'error'
+        return {player_name: "error"}
 
-def cleanup_old_data():
-    """古いデータを定期的に削除（1.5時間以上経過したものを対象）"""
-    current_time = datetime.now().timestamp()
-    cleanup_threshold = 5400  # 1.5時間 = 5400秒
+def check_player_status(player_name, sweep=None):
+    """プレイヤーの試合状態をチェック"""
+    region = PLAYER_REGIONS.get(player_name, DEFAULT_REGION)
+    main_url = live_page_url(player_name)
 
-    players_to_remove = []
+    # 直近に「試合中でない」「存在しない」と判定したプレイヤーは、一定時間は取得を省略する
+    cached_outcome = RESPONSE_CACHE.get_result(player_name)
+    if cached_outcome is not None:
+        METRIC_CACHE_HITS.inc(kind='result')
+        player_last_status[player_name] = cached_outcome
+        return "not_found" if cached_outcome == 'not_found' else None
 
-    for player in list(last_match_info.keys()):
-        matches = last_match_info[player]
-        original_count = len(matches)
+    try:
+        # 受信しながら分類・抽出する（失敗・遅延時は別の取得元を使う）
+        started = time.monotonic()
+        _, page = PROVIDERS.fetch(player_name, region)
+        if page is None:
+            EVENTS.publish(
+                'player_error', player=player_name, error="レスポンスがNoneです。プレイヤー名が間違っている可能性があります。"
+            )
+            logging.error("エラーが発生しました: レスポンスが None です: %s", player_name, extra={'player': player_name})
+            player_last_status[player_name] = 'error'
+            return "error"
 
-        # 1.5時間以上前のデータを削除
-        filtered_matches = [
-            match for match in matches
-            if current_time - match['timestamp'] < cleanup_threshold
-        ]
+        if page.content is not None:
+            save_html_log(player_name, page.content, page.scanner.outcome, page.truncated)
 
-        if filtered_matches:
-            last_match_info[player] = filtered_matches
-            removed_count = original_count - len(filtered_matches)
-            if removed_count > 0:
-                logging.info(f"{player}の古いマッチデータ{removed_count}件を削除しました")
-        else:
-            # 全てのデータが古い場合はプレイヤーごと削除
-            players_to_remove.append(player)
-            logging.info(f"{player}の全マッチデータを削除しました")
+        scanner = page.scanner
+        status_code = page.status_code
+        content_preview = page.preview
+        log_fields = _check_log_fields(page, started)
 
-    # 不要なプレイヤーを削除
-    for player in players_to_remove:
-        del last_match_info[player]
+        # 大きなレスポンスデータの参照を削除してメモリ解放
+        page = None
 
-    # 明示的なガベージコレクション
-    gc.collect()
+        # プレイヤーが存在しない場合の判定
+        if scanner.not_found:
+            current_time = datetime.now().timestamp()
+            last_notification = not_found_player_notifications.get(player_name, 0)
+            
+            # 3時間（10800秒）経過していれば通知
+            if current_time - last_notification >= 10800:
+                not_found_player_notifications[player_name] = current_time
+                STATE_STORE.mark_notification(player_name)
+                EVENTS.publish('player_not_found', player=player_name)
+            
+            logging.info(
+                "判定結果: プレイヤーが存在しません: %s", player_name,
+                extra={'player': player_name, 'outcome': 'not_found', **log_fields}
+            )
+            player_last_status[player_name] = 'not_found'
+            RESPONSE_CACHE.store_result(player_name, 'not_found')
+            return "not_found"
+        
+        # ローディング状態の確認
+        loading = scanner.loading
+        if loading:
+            if sweep is not None:
+                # live-partialは少し待ってから取得する（待つ間もワーカーは他のプレイヤーをチェックする）
+                player_last_status[player_name] = 'loading'
+                sweep.defer_partial(player_name)
+                return None
 
-    # メモリ使用量のログ出力（デバッグ用）
-    if logging.getLogger().isEnabledFor(logging.DEBUG):
-        import psutil
-        memory_usage = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-        logging.debug(".1f")
+            # スイープ外のチェックでは、APIエンドポイントをその場で呼び出す
+            page = fetch_partial_page(player_name, region)
+            scanner = page.scanner
+            status_code = page.status_code
+            content_preview = page.preview
+            # 所要時間はライブページの取得から、バイト数は両方の合計
+            log_fields = {'latency': round(time.monotonic() - started, 4), 'bytes': log_fields['bytes'] + page.bytes_read}
+            page = None
+
+        return evaluate_page(player_name, scanner, status_code, content_preview, main_url, sweep, loading, log_fields)
+        
+    except CircuitOpenError as e:
+        # 遮断の開始時に通知済みのため、プレイヤーごとには通知しない
+        logging.warning(
+            "%s のチェックをスキップしました: %s", player_name, e, extra={'player': player_name, 'outcome': 'error'}
+        )
+        player_last_status[player_name] = 'error'
+        return "error"
+    except Exception as e:
+        logging.error("エラーが発生しました: %s: %s", player_name, e, extra={'player': player_name, 'outcome': 'error'})
+        if PROVIDERS.circuit_open():
+            # 障害はホスト単位で通知しているため、プレイヤーごとの通知は送らない
+            player_last_status[player_name] = 'error'
+            return "error"
+        error_message = f"プレイヤー名が間違っている可能性があります。確認をお願いします。\nエラー詳細: {str(e)}"
+        EVENTS.publish('player_error', player=player_name, error=error_message)
+        player_last_status[player_name] = 'error'
+        return "error"
+
+def expire_old_matches():
+    """保持期間（1.5時間）を過ぎたマッチ情報を削除する"""
+    MATCH_LIFECYCLE.expire()
+    expired = MATCH_INDEX.expire()
+    for player in expired:
+        STATE_STORE.mark_match(player)
+    if expired:
+        logging.info(f"古いマッチデータを削除しました: {len(expired)}人")
 
 def cleanup_old_notifications():
     """3時間以上経過した通知履歴を削除"""
@@ -539,52 +3268,933 @@ def cleanup_old_notifications():
     for player_name in list(not_found_player_notifications.keys()):
         if current_time - not_found_player_notifications[player_name] >= 10800:
             del not_found_player_notifications[player_name]
+            STATE_STORE.mark_notification(player_name)
+
+class RosterValidator:
+    """名簿のプレイヤーが取得元に存在するかを並列に確認し、存在しないプレイヤーを隔離する
+
+    隔離したプレイヤーはポーリングの対象から外し、間隔を倍にしながら再確認する。
+    確認はポーリング用のスレッドで行い、結果はメインループの apply() でスケジューラに反映する。
+    確認の結果は StateStore から他の状態と一緒に保存する。
+    """
+
+    def __init__(self, ttl=ROSTER_VALIDATION_TTL, recheck_interval=QUARANTINE_RECHECK_INTERVAL,
+                 max_interval=QUARANTINE_MAX_INTERVAL, enabled=ROSTER_VALIDATION):
+        self.ttl = ttl
+        self.recheck_interval = recheck_interval
+        self.max_interval = max_interval
+        self.enabled = enabled
+        self._verified = {}     # プレイヤー -> 存在を確認した時刻
+        self.quarantine = {}    # プレイヤー -> (次に確認する時刻, 見つからなかった回数)
+        self._pending = {}      # プレイヤー -> 確認中の Future
+        self._dirty = set()     # 前回の保存から結果が変わったプレイヤー
+
+    def is_quarantined(self, player_name):
+        return player_name in self.quarantine
+
+    def is_validating(self, player_name):
+        return player_name in self._pending
+
+    def restore(self, results):
+        """保存済みの確認結果（changes の形式）を読み込む"""
+        for player_name, entry in results.items():
+            # 名簿から外れたプレイヤーの結果は読み込まない
+            if player_name not in PLAYER_DICT:
+                self._dirty.add(player_name)
+            elif entry.get('next_check') is not None:
+                self.quarantine[player_name] = (float(entry['next_check']), int(entry['failures']))
+            elif entry.get('verified') is not None:
+                self._verified[player_name] = float(entry['verified'])
+        if self.quarantine:
+            logging.info(f"存在しないプレイヤー {len(self.quarantine)}人を監視から外しています")
+
+    def changes(self):
+        """保存用に、前回から変わったプレイヤーの確認結果を返す（結果がなくなったプレイヤーはNone）"""
+        dirty, self._dirty = self._dirty, set()
+        results = {}
+        for player_name in dirty:
+            if player_name in self.quarantine:
+                next_check, failures = self.quarantine[player_name]
+                results[player_name] = {'next_check': next_check, 'failures': failures}
+            elif player_name in self._verified:
+                results[player_name] = {'verified': self._verified[player_name]}
+            else:
+                results[player_name] = None
+        return results
+
+    def mark_dirty(self, player_names):
+        """保存に失敗したプレイヤーを、次回も保存するよう戻す"""
+        self._dirty |= set(player_names)
+
+    def submit(self, player_names):
+        """確認済みの結果がないプレイヤーの確認を開始し、確認中のプレイヤーの集合を返す
+
+        隔離中のプレイヤーは再確認の時刻まで待つ。確認中のプレイヤーは、apply() で結果を反映するときに予定に入れる。
+        """
+        validating = set()
+        if not self.enabled:
+            return validating
+        now = time.time()
+        for player_name in player_names:
+            if player_name in self._pending:
+                validating.add(player_name)
+                continue
+            if player_name in self.quarantine:
+                if self.quarantine[player_name][0] > now:
+                    continue
+            elif now - self._verified.get(player_name, float('-inf')) < self.ttl:
+                continue
+            self._pending[player_name] = POLL_EXECUTOR.submit(self._check, player_name)
+            validating.add(player_name)
+        return validating
+
+    def _check(self, player_name):
+        """取得したページの判定結果（outcome）を返す。取得できなければNone"""
+        try:
+            _, page = PROVIDERS.fetch(player_name, PLAYER_REGIONS.get(player_name, DEFAULT_REGION))
+        except Exception as e:
+            logging.warning("名簿の検証に失敗しました: %s: %s", player_name, e, extra={'player': player_name})
+            return None
+        if page is None:
+            return None
+        return page.scanner.outcome
+
+    def apply(self, scheduler):
+        """完了した確認の結果をスケジューラに反映し、再確認の時刻が来た隔離中のプレイヤーを確認する"""
+        now = time.time()
+        for player_name, future in [(name, future) for name, future in self._pending.items() if future.done()]:
+            del self._pending[player_name]
+            outcome = future.result()
+            # 確認中に名簿から外れた場合は何もしない
+            if player_name not in PLAYER_DICT:
+                continue
+            if outcome == 'not_found':
+                self.quarantine_player(player_name, scheduler)
+                continue
+            if outcome not in (None, 'unknown'):
+                self._verified[player_name] = now
+                self._dirty.add(player_name)
+                if self.quarantine.pop(player_name, None) is not None:
+                    logging.info(f"{player_name} が見つかったため、監視を再開します")
+            if self.is_quarantined(player_name) or not CLUSTER.owns(player_name) or player_name in scheduler:
+                continue
+            if outcome == 'offline':
+                # 確認で取得したページを1回目のチェックとして、次回は通常の間隔でチェックする
+                scheduler.reschedule(player_name, outcome)
+            elif outcome in ('in_game', 'loading'):
+                # 試合の登録と通知は通常のチェックで行う
+                scheduler.add(player_name, 0)
+            else:
+                # 確認できなかったプレイヤーは通常のチェックに任せる
+                scheduler.add(player_name, random.uniform(0, SCHEDULE_ACTIVE_INTERVAL))
+        self.submit([name for name, (next_check, _) in self.quarantine.items() if next_check <= now])
+
+    def quarantine_player(self, player_name, scheduler, notify=True):
+        """見つからないプレイヤーを監視から外し、次に確認する時刻を決める"""
+        if not self.enabled:
+            return False
+        failures = self.quarantine.get(player_name, (0, 0))[1] + 1
+        interval = min(self.recheck_interval * 2 ** (failures - 1), self.max_interval)
+        self.quarantine[player_name] = (time.time() + interval, failures)
+        self._verified.pop(player_name, None)
+        self._dirty.add(player_name)
+        scheduler.remove(player_name)
+        logging.warning(
+            "%s が見つからないため、監視から外します（%.1f時間後に再確認）", player_name, interval / 3600,
+            extra={'player': player_name, 'outcome': 'not_found'}
+        )
+        EVENTS.publish(
+            'player_quarantined', player=player_name, failures=failures, recheck_after=interval,
+            notify=notify and failures == 1
+        )
+        return True
+
+    def forget(self, player_name):
+        self._pending.pop(player_name, None)
+        verified = self._verified.pop(player_name, None)
+        quarantined = self.quarantine.pop(player_name, None)
+        if verified is not None or quarantined is not None:
+            self._dirty.add(player_name)
+
+ROSTER_VALIDATOR = RosterValidator()
+
+class StateBackend:
+    """状態の保存先のインターフェース（このクラス自体は何も保存しない）"""
+
+    def load(self):
+        """(プレイヤーごとのマッチ情報, not_found_player_notifications, 進行中の試合, 名簿の確認結果) の保存内容を返す"""
+        return {}, {}, {}, {}
+
+    def save(self, matches, notifications, live_matches, validation):
+        """変更のあったプレイヤー・試合の分をまとめて書き込む（値が空・Noneのものは削除）"""
+
+    def close(self):
+        pass
+
+class SQLiteStateBackend(StateBackend):
+    """ローカルのSQLite（WALモード）に状態を保存する"""
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS match_info (player_name TEXT PRIMARY KEY, matches TEXT NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS not_found_notifications (player_name TEXT PRIMARY KEY, notified_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS live_matches (match_id TEXT PRIMARY KEY, state TEXT NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS roster_validation '
+                '(player_name TEXT PRIMARY KEY, verified REAL, next_check REAL, failures INTEGER)'
+            )
+
+    def load(self):
+        matches = {
+            player_name: json.loads(data)
+            for player_name, data in self._conn.execute('SELECT player_name, matches FROM match_info')
+        }
+        notifications = dict(self._conn.execute('SELECT player_name, notified_at FROM not_found_notifications'))
+        live_matches = {
+            match_id: json.loads(data)
+            for match_id, data in self._conn.execute('SELECT match_id, state FROM live_matches')
+        }
+        validation = {
+            player_name: {'verified': verified, 'next_check': next_check, 'failures': failures}
+            for player_name, verified, next_check, failures in self._conn.execute(
+                'SELECT player_name, verified, next_check, failures FROM roster_validation'
+            )
+        }
+        return matches, notifications, live_matches, validation
+
+    def save(self, matches, notifications, live_matches, validation):
+        # 1スイープ分の変更を1トランザクションで書き込む
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO match_info (player_name, matches) VALUES (?, ?)',
+                [(name, json.dumps(value, ensure_ascii=False)) for name, value in matches.items() if value]
+            )
+            self._conn.executemany(
+                'DELETE FROM match_info WHERE player_name = ?',
+                [(name,) for name, value in matches.items() if not value]
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO not_found_notifications (player_name, notified_at) VALUES (?, ?)',
+                [(name, value) for name, value in notifications.items() if value is not None]
+            )
+            self._conn.executemany(
+                'DELETE FROM not_found_notifications WHERE player_name = ?',
+                [(name,) for name, value in notifications.items() if value is None]
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO live_matches (match_id, state) VALUES (?, ?)',
+                [(match_id, json.dumps(value, ensure_ascii=False)) for match_id, value in live_matches.items() if value]
+            )
+            self._conn.executemany(
+                'DELETE FROM live_matches WHERE match_id = ?',
+                [(match_id,) for match_id, value in live_matches.items() if not value]
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO roster_validation (player_name, verified, next_check, failures) VALUES (?, ?, ?, ?)',
+                [
+                    (name, value.get('verified'), value.get('next_check'), value.get('failures'))
+                    for name, value in validation.items() if value
+                ]
+            )
+            self._conn.executemany(
+                'DELETE FROM roster_validation WHERE player_name = ?',
+                [(name,) for name, value in validation.items() if not value]
+            )
+
+    def close(self):
+        self._conn.close()
+
+def create_state_backend():
+    """STATE_BACKEND の設定に応じた保存先を作成する"""
+    if STATE_BACKEND == 'none':
+        return StateBackend()
+    if STATE_BACKEND != 'sqlite':
+        logging.warning(f"不明なSTATE_BACKEND '{STATE_BACKEND}' のため、sqliteを使用します")
+    try:
+        return SQLiteStateBackend(STATE_DB_PATH)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"状態の保存先を開けなかったため、永続化を無効にします: {str(e)}")
+        return StateBackend()
+
+class StateStore:
+    """MATCH_INDEX・MATCH_LIFECYCLE・not_found_player_notifications・名簿の確認結果の変更を記録し、まとめて保存する"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._dirty_matches = set()
+        self._dirty_notifications = set()
+
+    def mark_match(self, player_name):
+        with self._lock:
+            self._dirty_matches.add(player_name)
+
+    def mark_notification(self, player_name):
+        with self._lock:
+            self._dirty_notifications.add(player_name)
+
+    def load(self):
+        """保存済みの状態をメモリ上の辞書に読み込む（起動時）"""
+        started = time.monotonic()
+        matches, notifications, live_matches, validation = self.backend.load()
+        for player_name, player_matches in matches.items():
+            MATCH_INDEX.restore(player_name, player_matches)
+        not_found_player_notifications.update(notifications)
+        for live_match in live_matches.values():
+            MATCH_LIFECYCLE.restore(live_match)
+        ROSTER_VALIDATOR.restore(validation)
+        logging.info(
+            f"保存済みの状態を読み込みました: マッチ履歴 {len(matches)}人 / 未検出通知 {len(notifications)}人"
+            f" / 進行中の試合 {len(live_matches)}件 / 名簿の確認結果 {len(validation)}人"
+            f"（{(time.monotonic() - started) * 1000:.1f}ms）"
+        )
+
+    def flush(self):
+        """変更のあったプレイヤー分だけをまとめて保存する"""
+        with self._lock:
+            dirty_matches, self._dirty_matches = self._dirty_matches, set()
+            dirty_notifications, self._dirty_notifications = self._dirty_notifications, set()
+        live_matches = MATCH_LIFECYCLE.changes()
+        validation = ROSTER_VALIDATOR.changes()
+        if not dirty_matches and not dirty_notifications and not live_matches and not validation:
+            return
+
+        matches = {name: MATCH_INDEX.snapshot(name) for name in dirty_matches}
+        notifications = {name: not_found_player_notifications.get(name) for name in dirty_notifications}
+        try:
+            self.backend.save(matches, notifications, live_matches, validation)
+        except Exception as e:
+            logging.error(f"状態の保存に失敗しました: {str(e)}")
+            # 次のスイープで再度保存する
+            with self._lock:
+                self._dirty_matches |= dirty_matches
+                self._dirty_notifications |= dirty_notifications
+            MATCH_LIFECYCLE.mark_dirty(live_matches)
+            ROSTER_VALIDATOR.mark_dirty(validation)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+# 起動時（main）に STATE_BACKEND の保存先へ切り替える
+STATE_STORE = StateStore(StateBackend())
+
+class HashRing:
+    """仮想ノードつきのコンシステントハッシュ（レプリカの増減で移動するプレイヤーを最小にする）"""
+
+    def __init__(self, replicas, virtual_nodes=SHARD_VIRTUAL_NODES):
+        self.replicas = tuple(sorted(replicas))
+        points = sorted(
+            (self._hash(f"{replica}#{i}"), replica)
+            for replica in self.replicas for i in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [replica for _, replica in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def owner(self, key):
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+class SQLiteLeaseStore:
+    """レプリカのリースとマッチ通知の取得権を、共有のSQLiteファイルで管理する"""
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS replicas (replica_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS match_claims (match_id TEXT PRIMARY KEY, replica_id TEXT NOT NULL, claimed_at REAL NOT NULL)'
+        )
+
+    def heartbeat(self, replica_id, ttl):
+        """リースを更新し、有効なリースを持つレプリカの一覧を返す"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO replicas (replica_id, expires_at) VALUES (?, ?)', (replica_id, now + ttl)
+            )
+            self._conn.execute('DELETE FROM replicas WHERE expires_at <= ?', (now,))
+            return [row[0] for row in self._conn.execute('SELECT replica_id FROM replicas')]
+
+    def release(self, replica_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM replicas WHERE replica_id = ?', (replica_id,))
+
+    def claim(self, key, replica_id, retention):
+        """通知の取得権を得る。既に他のレプリカが取得していればFalse"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('DELETE FROM match_claims WHERE claimed_at <= ?', (now - retention,))
+            self._conn.execute(
+                'INSERT OR IGNORE INTO match_claims (match_id, replica_id, claimed_at) VALUES (?, ?, ?)',
+                (key, replica_id, now)
+            )
+            row = self._conn.execute('SELECT replica_id FROM match_claims WHERE match_id = ?', (key,)).fetchone()
+        return row is not None and row[0] == replica_id
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Cluster:
+    """レプリカ間で名簿を分担し、同じマッチの通知が1回になるよう調整する
+
+    store が None の間（既定）は1プロセスで全員を担当する。
+    """
+
+    def __init__(self, replica_id=SHARD_REPLICA_ID):
+        self.replica_id = replica_id
+        self.store = None
+        self.ring = HashRing([replica_id])
+        self._last_heartbeat = None
+
+    def owns(self, player_name):
+        return self.store is None or self.ring.owner(player_name) == self.replica_id
+
+    def refresh(self, force=False):
+        """リースを更新し、担当するレプリカの構成が変わった場合はTrueを返す"""
+        if self.store is None:
+            return False
+        now = time.monotonic()
+        if not force and self._last_heartbeat is not None and now - self._last_heartbeat < SHARD_HEARTBEAT_INTERVAL:
+            return False
+        self._last_heartbeat = now
+        try:
+            replicas = self.store.heartbeat(self.replica_id, SHARD_LEASE_TTL)
+        except sqlite3.Error as e:
+            logging.error(f"リースを更新できませんでした: {str(e)}")
+            return False
+        if self.replica_id not in replicas:
+            replicas.append(self.replica_id)
+        if tuple(sorted(replicas)) == self.ring.replicas:
+            return False
+        self.ring = HashRing(replicas)
+        logging.info(f"レプリカ構成が変わりました: {len(replicas)}台（{', '.join(self.ring.replicas)}）")
+        return True
+
+    def claim_match(self, key):
+        """このレプリカが通知を送ってよいか（他のレプリカが先に取得していればFalse）"""
+        if self.store is None:
+            return True
+        try:
+            return self.store.claim(key, self.replica_id, MATCH_RETENTION_SECONDS)
+        except sqlite3.Error as e:
+            # 取得権を確認できない場合は、通知の欠落より重複を選ぶ
+            logging.error(f"マッチの通知権を確認できませんでした: {str(e)}")
+            return True
+
+    def sync_schedule(self, scheduler):
+        """担当するプレイヤーだけがスケジューラに登録されている状態にする"""
+        owned = [name for name in PLAYER_DICT if self.owns(name)]
+        owned_set = set(owned)
+        released = [name for name in scheduler.players() if name not in owned_set]
+        for player_name in released:
+            scheduler.remove(player_name)
+        acquired = [
+            name for name in owned
+            if name not in scheduler and not ROSTER_VALIDATOR.is_quarantined(name) and not ROSTER_VALIDATOR.is_validating(name)
+        ]
+        # 確認を始めたプレイヤーは、結果を反映するときに予定に入れる
+        validating = ROSTER_VALIDATOR.submit(acquired)
+        for player_name in acquired:
+            if player_name not in validating:
+                scheduler.add(player_name, random.uniform(0, SCHEDULE_ACTIVE_INTERVAL))
+        if released or acquired:
+            logging.info(f"担当プレイヤーを更新しました: 追加 {len(acquired)}人 / 解除 {len(released)}人（担当 {len(scheduler)}人）")
+
+    def close(self):
+        if self.store is not None:
+            try:
+                # 他のレプリカがすぐに引き継げるようリースを返す
+                self.store.release(self.replica_id)
+            finally:
+                self.store.close()
+
+CLUSTER = Cluster()
+
+def forget_player(player_name):
+    """名簿から外れたプレイヤーの状態を削除する（保存先からも次のflushで削除される）"""
+    MATCH_INDEX.forget(player_name)
+    MATCH_LIFECYCLE.forget(player_name)
+    PLAYER_STATS.forget(player_name)
+    not_found_player_notifications.pop(player_name, None)
+    player_last_status.pop(player_name, None)
+    player_event_status.pop(player_name, None)
+    RESPONSE_CACHE.forget(player_name)
+    ROSTER_VALIDATOR.forget(player_name)
+    STATE_STORE.mark_match(player_name)
+    STATE_STORE.mark_notification(player_name)
+
+class HealthState:
+    """/health で返す生存情報（最後にスイープが完了した時刻）"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.last_sweep = None
+
+    def mark_sweep(self):
+        self.last_sweep = time.time()
+
+    def status(self):
+        # 起動直後はまだスイープがないため、起動時刻からの経過時間で判定する
+        age = time.time() - (self.last_sweep or self.started)
+        return age < HEALTH_MAX_SWEEP_AGE, {
+            'status': 'ok' if age < HEALTH_MAX_SWEEP_AGE else 'stale',
+            'last_sweep': self.last_sweep,
+            'last_sweep_age_seconds': round(age, 1),
+        }
+
+HEALTH = HealthState()
+
+class StartupTimer:
+    """プロセス開始から各起動段階・最初のリクエストまでの時間を記録する"""
+
+    def __init__(self, started):
+        self.started = started
+        self.phases = []
+        self.first_request = None
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = time.perf_counter() - self.started
+        self.phases.append((phase, elapsed))
+        METRIC_STARTUP_SECONDS.set(round(elapsed, 4), phase=phase)
 
-def main():
+    def mark_first_request(self):
+        if self.first_request is not None:
+            return
+        with self._lock:
+            if self.first_request is None:
+                self.first_request = round(time.perf_counter() - self.started, 4)
+                METRIC_STARTUP_SECONDS.set(self.first_request, phase='first_request')
+
+    def report(self):
+        phases = list(self.phases)
+        if self.first_request is not None:
+            phases.append(('first_request', self.first_request))
+        lines = [f"  {phase:<16} {elapsed * 1000:8.1f} ms" for phase, elapsed in sorted(phases, key=lambda p: p[1])]
+        return "起動時間（プロセス開始から）:\n" + '\n'.join(lines)
+
+STARTUP = StartupTimer(PROCESS_STARTED)
+
+class SweepProfiler:
+    """指示を受けた後の数スイープについて、cProfile または tracemalloc の結果をファイルに書き出す"""
+
+    MODES = ('cpu', 'memory')
+
+    def __init__(self, directory, sweeps=PROFILE_SWEEPS, top_n=PROFILE_TOP_N):
+        self.directory = Path(directory)
+        self.sweeps = sweeps
+        self.top_n = top_n
+        # シグナルハンドラからも設定するため、ロックを取らずに代入だけで受け渡す
+        self._pending = None
+        self._mode = None
+        self._remaining = 0
+        self._profiles = []
+        self._main_profile = None
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def request(self, mode, sweeps=None):
+        """次のスイープから mode（cpu / memory）の計測を始めるよう予約する"""
+        if mode not in self.MODES:
+            raise ValueError(f"不明なプロファイルの種類です: '{mode}'")
+        self._pending = (mode, sweeps or self.sweeps)
+
+    def wrap(self, func):
+        """CPUの計測中は、ワーカーで実行する関数をcProfileで包む"""
+        if self._mode != 'cpu':
+            return func
+        import cProfile
+
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # 別のプロファイラが有効な場合（Python 3.12以降は同時に1つまで）は計測しない
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self._lock:
+                    self._profiles.append(profile)
+        return profiled
+
+    def before_sweep(self):
+        if self._mode is None and self._pending is not None:
+            (self._mode, self._remaining), self._pending = self._pending, None
+            if self._mode == 'memory':
+                tracemalloc.start(PROFILE_TRACE_FRAMES)
+                self._baseline = tracemalloc.take_snapshot()
+            logging.info("プロファイルを開始します: %s（%dスイープ）", self._mode, self._remaining)
+        if self._mode == 'cpu':
+            # メインスレッド（結果の集計・通知）も計測する
+            import cProfile
+            self._main_profile = cProfile.Profile()
+            try:
+                self._main_profile.enable()
+            except ValueError:
+                self._main_profile = None
+
+    def after_sweep(self):
+        if self._mode is None:
+            return
+        if self._main_profile is not None:
+            self._main_profile.disable()
+            self._profiles.append(self._main_profile)
+            self._main_profile = None
+        self._remaining -= 1
+        if self._remaining > 0:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            path = self._write_cpu(stamp) if self._mode == 'cpu' else self._write_memory(stamp)
+            if path is not None:
+                logging.info("プロファイルを書き出しました: %s", path)
+        except OSError as e:
+            logging.error("プロファイルを書き出せませんでした: %s", e)
+        finally:
+            if self._mode == 'memory':
+                tracemalloc.stop()
+            self._mode = None
+            self._baseline = None
+            with self._lock:
+                self._profiles = []
+
+    def _write_cpu(self, stamp):
+        """pstats 形式（snakeviz などで開ける）と、累積時間の上位のテキストを書き出す"""
+        import pstats
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        path = self.directory / f"cpu_{stamp}.prof"
+        stats.dump_stats(str(path))
+        with open(path.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+            stats.stream = f
+            stats.sort_stats('cumulative').print_stats(self.top_n)
+        return path
+
+    def _write_memory(self, stamp):
+        """スナップショット（tracemalloc.Snapshot.load で読める）と、割り当て・増加量の上位を書き出す"""
+        ignored = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        )
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignored)
+        path = self.directory / f"memory_{stamp}.tracemalloc"
+        snapshot.dump(str(path))
+        with open(path.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+            f.write(f"# 割り当ての上位 {self.top_n} 件\n")
+            for stat in snapshot.statistics('lineno')[:self.top_n]:
+                f.write(f"{stat}\n")
+            f.write(f"\n# 計測開始からの増加の上位 {self.top_n} 件\n")
+            for stat in snapshot.compare_to(self._baseline.filter_traces(ignored), 'lineno')[:self.top_n]:
+                f.write(f"{stat}\n")
+        return path
+
+PROFILER = SweepProfiler(PROFILE_DIR)
+
+class MonitoringHandler(BaseHTTPRequestHandler):
+    """/health と /metrics を返すHTTPハンドラ"""
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/health':
+            healthy, body = HEALTH.status()
+            self._respond(200 if healthy else 503, 'application/json', json.dumps(body))
+        elif path == '/metrics':
+            self._respond(200, 'text/plain; version=0.0.4; charset=utf-8', METRICS.render())
+        else:
+            self._respond(404, 'text/plain; charset=utf-8', 'not found\n')
+
+    def do_POST(self):
+        # POST /debug/profile?mode=cpu|memory&sweeps=K で次のスイープからプロファイルを取得する
+        path, _, query = self.path.partition('?')
+        if path != '/debug/profile' or not PROFILE_ADMIN_TOKEN:
+            self._respond(404, 'text/plain; charset=utf-8', 'not found\n')
+            return
+        if not hmac.compare_digest(self.headers.get('X-Admin-Token', ''), PROFILE_ADMIN_TOKEN):
+            self._respond(403, 'text/plain; charset=utf-8', 'forbidden\n')
+            return
+        params = parse_qs(query)
+        try:
+            mode = params.get('mode', ['cpu'])[0]
+            sweeps = int(params.get('sweeps', ['0'])[0]) or None
+            PROFILER.request(mode, sweeps)
+        except ValueError as e:
+            self._respond(400, 'text/plain; charset=utf-8', f"{e}\n")
+            return
+        self._respond(202, 'application/json', json.dumps({'mode': mode, 'sweeps': sweeps or PROFILER.sweeps}))
+
+    def _respond(self, status, content_type, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # ヘルスチェックのたびにアクセスログを出さない
+        pass
+
+def start_monitoring_server(port):
+    """ヘルスチェック・メトリクス用のHTTPサーバーを別スレッドで起動する"""
+    server = ThreadingHTTPServer(('0.0.0.0', port), MonitoringHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='monitoring-http', daemon=True).start()
+    logging.info(f"ヘルスチェック・メトリクスを公開しました: http://0.0.0.0:{port}/health, /metrics")
+    return server
+
+class PollScheduler:
+    """プレイヤーごとの次回チェック時刻を管理する優先度キュー（適応型スケジューラ）"""
+
+    def __init__(self):
+        self._heap = []            # (次回チェック時刻, プレイヤー名)
+        self._next_check = {}      # プレイヤー名 -> 有効な次回チェック時刻
+        self._streak = {}          # プレイヤー名 -> (直前の状態, 連続回数)
+        self._in_game_since = {}   # プレイヤー名 -> 試合を検出した時刻
+        self._last_game_end = {}   # プレイヤー名 -> 試合終了を検出した時刻
+
+    def __len__(self):
+        return len(self._next_check)
+
+    def __contains__(self, player_name):
+        return player_name in self._next_check
+
+    def players(self):
+        return list(self._next_check)
+
+    def add(self, player_name, delay):
+        """delay秒後にチェックするよう登録（既存の予定は上書き）"""
+        due = time.monotonic() + delay
+        self._next_check[player_name] = due
+        heapq.heappush(self._heap, (due, player_name))
+
+    def remove(self, player_name):
+        """監視対象から外す（ヒープ上の古いエントリは取り出し時に捨てる）"""
+        self._next_check.pop(player_name, None)
+        self._streak.pop(player_name, None)
+        self._in_game_since.pop(player_name, None)
+        self._last_game_end.pop(player_name, None)
+
+    def _discard_stale(self):
+        while self._heap and self._next_check.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def seconds_until_next(self):
+        """次のチェック予定までの秒数（予定がなければNone）"""
+        self._discard_stale()
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def pop_due(self, window=0.0):
+        """window秒以内にチェック予定のプレイヤーをまとめて取り出す"""
+        limit = time.monotonic() + window
+        due_players = []
+        while self._heap and self._heap[0][0] <= limit:
+            due, player_name = heapq.heappop(self._heap)
+            if self._next_check.get(player_name) != due:
+                continue  # 再登録・削除済みの古いエントリ
+            del self._next_check[player_name]
+            due_players.append(player_name)
+        return due_players
+
+    def reschedule(self, player_name, status):
+        """直前のチェック結果から次回チェックまでの間隔を決めて再登録する"""
+        now = time.monotonic()
+        prev_status, count = self._streak.get(player_name, (None, 0))
+        count = min(count + 1, 20) if status == prev_status else 1
+        self._streak[player_name] = (status, count)
+
+        if status == 'in_game':
+            # 試合が終わっていないはずの間はリクエストしない
+            since = self._in_game_since.setdefault(player_name, now)
+            delay = max(SCHEDULE_IN_GAME_RECHECK, SCHEDULE_MIN_GAME_LENGTH - (now - since))
+        else:
+            if self._in_game_since.pop(player_name, None) is not None:
+                self._last_game_end[player_name] = now
+            last_game_end = self._last_game_end.get(player_name)
+
+            if status == 'not_found':
+                delay = min(SCHEDULE_NOT_FOUND_MAX_INTERVAL, SCHEDULE_NOT_FOUND_INTERVAL * 2 ** (count - 1))
+            elif status == 'offline' and last_game_end is not None and now - last_game_end < SCHEDULE_ACTIVE_WINDOW:
+                # 試合終了直後は次の試合が始まりやすいので短い間隔でチェック
+                delay = SCHEDULE_ACTIVE_INTERVAL
+            else:
+                # オフライン・エラーが続くほど間隔を伸ばす
+                delay = min(SCHEDULE_MAX_INTERVAL, SCHEDULE_BASE_INTERVAL * 1.5 ** (count - 1))
+                # 普段この時間帯に試合を始めるプレイヤーは、基本間隔より伸ばさない
+                if status == 'offline' and PLAYER_STATS.start_likelihood(player_name) >= SCHEDULE_LIKELY_START_RATIO:
+                    delay = min(delay, SCHEDULE_BASE_INTERVAL)
+
+        # 同じタイミングにリクエストが集中しないよう±10%ずらす
+        self.add(player_name, delay * random.uniform(0.9, 1.1))
+        return delay
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="porofessor.gg のライブ試合を監視してDiscordに通知する")
+    parser.add_argument(
+        '--startup-timing', action='store_true',
+        help="起動の各段階と最初のスイープまでの時間を表示する"
+    )
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """メイン監視ループ"""
+    args = parse_args(argv)
+    STARTUP.mark('import')
+
+    # ログの設定（書式化と出力は別スレッドで行う）
+    setup_logging()
+
+    load_roster()
+    STARTUP.mark('roster')
+
+    # 起動時のログ（プレイヤーの一覧はDEBUGのみ）
     logging.info("=== LeagueBirdWatcher 起動 ===")
-    logging.info(f"監視対象プレイヤー数: {len(PLAYER_DICT)}")
-    logging.info("有効カテゴリ: " + ", ".join(ACTIVE_CATEGORIES.keys()))
+    logging.info(f"起動時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logging.info(
+        f"監視対象プレイヤー数: {len(PLAYER_DICT)}（"
+        + ", ".join(f"{category} {len(players)}" for category, players in PLAYERS_BY_CATEGORY.items())
+        + "）"
+    )
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        for player_name, nickname in PLAYER_DICT.items():
+            logging.debug(f"- {nickname or player_name} ({player_name}) [{PLAYER_CATEGORIES[player_name]}]")
+
+    # 前回までの通知履歴を復元し、再起動直後の重複通知を防ぐ
+    STATE_STORE.backend = create_state_backend()
+    STATE_STORE.load()
+    atexit.register(STATE_STORE.close)
+    STARTUP.mark('state')
+
+    # Dockerfile の HEALTHCHECK が参照する /health と、/metrics を公開する
+    if HEALTH_PORT:
+        try:
+            start_monitoring_server(HEALTH_PORT)
+        except OSError as e:
+            logging.error(f"ヘルスチェック用HTTPサーバーを起動できませんでした: {str(e)}")
+
+    # kill -USR1 でCPU、kill -USR2 でメモリのプロファイルを次のスイープから取得する
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: PROFILER.request('cpu'))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: PROFILER.request('memory'))
 
-    for player_name, nickname in PLAYER_DICT.items():
-        category = PLAYER_CATEGORIES.get(player_name, 'friend')
-        logging.info(f"- {nickname or player_name} ({player_name}) [{category}]")
+    # 複数レプリカで分担する場合は、リースを取得してから担当分を決める
+    if SHARD_STORE_PATH:
+        CLUSTER.store = SQLiteLeaseStore(SHARD_STORE_PATH)
+        CLUSTER.refresh(force=True)
+        atexit.register(CLUSTER.close)
+        logging.info(f"シャーディングを有効にしました: レプリカ {CLUSTER.replica_id}")
+
+    scheduler = PollScheduler()
+    # 前回までに存在しないと分かったプレイヤー（STATE_STORE.load で復元済み）は、再確認の時刻まで監視しない
+    owned_players = [name for name in PLAYER_DICT if CLUSTER.owns(name)]
+    # 存在するかの確認はポーリングと並行して進め、結果はメインループで反映する。
+    # 確認するプレイヤーは、確認の取得を1回目のチェックとして結果が出てから予定に入れる
+    validating = ROSTER_VALIDATOR.submit(owned_players)
+    # それ以外の初回チェックは基本間隔の中に分散させ、起動直後にリクエストが集中しないようにする
+    for player_name in owned_players:
+        if player_name not in validating and not ROSTER_VALIDATOR.is_quarantined(player_name):
+            scheduler.add(player_name, random.uniform(0, SCHEDULE_BASE_INTERVAL))
+    roster_watcher = RosterWatcher(ROSTER_PATH) if ROSTER_PATH else None
+    STARTUP.mark('ready')
+    startup_reported = not args.startup_timing
 
     cycle_count = 0
 
     while True:
         try:
+            if roster_watcher is not None:
+                roster_watcher.poll(scheduler)
+                # 削除のみの再読み込みもすぐに保存する
+                STATE_STORE.flush()
+            if CLUSTER.refresh():
+                CLUSTER.sync_schedule(scheduler)
+            ROSTER_VALIDATOR.apply(scheduler)
+            # 確認の結果はスイープを待たずに保存する
+            STATE_STORE.flush()
+            METRIC_SCHEDULED_PLAYERS.set(len(scheduler))
+            wait = scheduler.seconds_until_next()
+            # 待機はSCHEDULER_TICKごとに区切り、チェック対象がいない間もループが生きていることを記録する
+            time.sleep(SCHEDULER_TICK if wait is None else min(wait, SCHEDULER_TICK))
+
+            # 次のSCHEDULER_TICK秒以内に予定されているプレイヤーを1回のスイープでチェック
+            due_players = scheduler.pop_due(SCHEDULER_TICK)
+            if not due_players:
+                HEALTH.mark_sweep()
+                continue
+
             cycle_count += 1
-            logging.info(f"=== 監視サイクル {cycle_count} 開始 ===")
+            logging.info(f"=== 監視サイクル {cycle_count} 開始（{len(due_players)}人） ===")
 
-            # 定期的なデータクリーンアップ（10サイクルごと）
-            if cycle_count % 10 == 0:
-                logging.info("定期クリーンアップを実行します")
-                cleanup_old_data()
-                cleanup_old_notifications()
-            else:
-                # 軽量クリーンアップ
-                cleanup_old_notifications()
+            # 期限切れのデータを削除（期限順に取り出すため、全件の走査はしない）
+            expire_old_matches()
+            cleanup_old_notifications()
 
-            # 全プレイヤーのチェック
-            check_all_players()
+            checked_players = set(due_players)
+            PROFILER.before_sweep()
+            try:
+                # 同じページから解決した（予定より前の）プレイヤーも再登録の対象にする
+                checked_players |= check_players(due_players)
+            finally:
+                PROFILER.after_sweep()
+                # 例外が起きてもプレイヤーが予定から消えないよう必ず再登録する
+                for player_name in checked_players:
+                    # 担当が他のレプリカに移ったプレイヤーや、隔離中のプレイヤーは予定に戻さない
+                    if not CLUSTER.owns(player_name) or ROSTER_VALIDATOR.is_quarantined(player_name):
+                        continue
+                    status = player_last_status.get(player_name, 'unknown')
+                    # ポーリング中に見つからなくなったプレイヤーも隔離する（通知はチェック時に送信済み）
+                    if status == 'not_found' and ROSTER_VALIDATOR.quarantine_player(player_name, scheduler, notify=False):
+                        continue
+                    scheduler.reschedule(player_name, status)
 
             # Northflank最適化: メモリ使用量ログ（デバッグ時のみ）
             if logging.getLogger().isEnabledFor(logging.DEBUG):
-                try:
-                    import psutil
-                    memory_usage = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-                    logging.debug(".1f")
-                except ImportError:
-                    pass
+                rss = process_rss_bytes()
+                if rss is not None:
+                    logging.debug("メモリ使用量: %.1fMB", rss / 1024 / 1024)
 
-            logging.info(f"監視サイクル {cycle_count} 完了。次のチェックまで300秒待機します")
-            time.sleep(300)
+            logging.info(f"監視サイクル {cycle_count} 完了（監視中: {len(scheduler)}人）")
+            if not startup_reported:
+                STARTUP.mark('first_sweep')
+                print(STARTUP.report())
+                startup_reported = True
 
         except Exception as e:
             logging.error(f"予期せぬエラーが発生しました: {str(e)}")
             logging.error(f"エラー詳細: {type(e).__name__}: {e}", exc_info=True)
-            time.sleep(300)
+            time.sleep(SCHEDULER_TICK)
             continue
 
 if __name__ == "__main__":
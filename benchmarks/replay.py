@@ -0,0 +1,277 @@
+"""保存済みHTMLログ（アーカイブまたは *.html）を使ったオフラインのリプレイベンチマーク
+
+保存済みページを返すローカルサーバー（遅延・429/5xxの注入あり）を別プロセスで起動し、
+porofessor.gg の代わりにそのサーバーへ check_players を実行する。
+名簿の人数とワーカー数の組み合わせごとに、スループット・レイテンシのパーセンタイル・
+メモリ割り当て（tracemalloc）・ピークRSSを表示する。
+
+使い方:
+    python benchmarks/replay.py [ログディレクトリ] [--roster 10,50] [--workers 1,8] [--sweeps N]
+        [--latency-ms N] [--jitter-ms N] [--throttle-rate R] [--error-rate R]
+    python benchmarks/replay.py [ログディレクトリ] --serve --port 8081
+        （サーバーのみ起動。POROFESSOR_BASE_URL=http://127.0.0.1:8081 で Watcher.py を向けるか、
+          LIVE_PROVIDERS=porofessor,mock=http://127.0.0.1:8081 で予備の取得元にする）
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVE_CHUNK_SIZE = 16384
+
+
+def load_corpus(log_dir):
+    """(プレイヤー名, ページ) のリスト。APIレスポンス（*_api_*）は除く"""
+    # scan_pages は Watcher を読み込むため、計測用のプロセスでは読み込まない
+    from scan_pages import load_pages
+
+    return [
+        (player_name, content) for player_name, content in load_pages(log_dir)
+        if not player_name.endswith('_api')
+    ]
+
+
+def build_roster(corpus, size):
+    """名簿の人数に合わせてページを割り当てる
+
+    保存済みページより人数が多い場合は、別名のプレイヤーを作り、
+    ページ上のカードの名前も置き換えて同じ解析結果になるようにする。
+    """
+    roster = []
+    for i in range(size):
+        player_name, content = corpus[i % len(corpus)]
+        if i >= len(corpus):
+            name, _, tag = player_name.partition('#')
+            # Riot IDの名前は16文字までのため、元の名前を削って番号を付ける
+            suffix = f"r{i}"
+            alias = f"{name[:16 - len(suffix)]}{suffix}#{tag}"
+            content = re.sub(
+                'data-summonername="' + re.escape(player_name) + '"',
+                f'data-summonername="{alias}"',
+                content,
+                flags=re.IGNORECASE,
+            )
+            player_name = alias
+        roster.append((player_name, content))
+    return roster
+
+
+def page_key(player_name):
+    return player_name.replace('#', '-').lower()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """/live/{地域}/{名前} と /partial/live-partial/{地域}/{名前} に保存済みページを返す"""
+
+    def do_GET(self):
+        options = self.server.options
+        delay = options.latency_ms + random.uniform(-options.jitter_ms, options.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        roll = random.random()
+        if roll < options.throttle_rate:
+            self._send(429, b'Too Many Requests', {'Retry-After': '1'})
+            return
+        if roll < options.throttle_rate + options.error_rate:
+            self._send(random.choice((500, 502, 503)), b'Server Error')
+            return
+
+        body = self.server.pages.get(page_key(self.path.rstrip('/').rsplit('/', 1)[-1]))
+        if body is None:
+            body = b'<html><body><h2>Summoner not found</h2></body></html>'
+        self._send(200, body)
+
+    def do_POST(self):
+        # Discord Webhook の代わりに通知を受け取る
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send(self, status, body, headers=None):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            # 分割して送り、クライアントが早期終了した場合は送信をやめる
+            for start in range(0, len(body), SERVE_CHUNK_SIZE):
+                self.wfile.write(body[start:start + SERVE_CHUNK_SIZE])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(corpus, roster_size, options, port=0, ready=None):
+    server = ThreadingHTTPServer(('127.0.0.1', port), ReplayHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.pages = {
+        page_key(player_name): content.encode('utf-8')
+        for player_name, content in build_roster(corpus, roster_size)
+    }
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_case(base_url, player_names, workers, options, results):
+    """新しいプロセスで Watcher を読み込み、1つの組み合わせを計測する"""
+    os.environ.update({
+        'POROFESSOR_BASE_URL': base_url,
+        'DISCORD_WEBHOOK_URL_FRIEND': f'{base_url}/webhook',
+        'FRIEND_LIST': ','.join(player_names),
+        'POLL_WORKERS': str(workers),
+        'POROFESSOR_RATE_LIMIT': str(options.rate_limit),
+        'RESULT_CACHE_TTL': '0',
+        'NOT_FOUND_CACHE_TTL': '0',
+        'SAVE_HTML_LOG': 'false',
+        'STATE_BACKEND': 'none',
+        'HEALTH_PORT': '0',
+    })
+    sys.path.insert(0, str(ROOT))
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import Watcher
+        import logging
+        logging.getLogger().setLevel(logging.ERROR)
+        Watcher.load_roster()
+
+        latencies = []
+        check_player_status = Watcher.check_player_status
+
+        def timed_check(player_name, sweep=None):
+            start = time.perf_counter()
+            try:
+                return check_player_status(player_name, sweep)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        Watcher.check_player_status = timed_check
+        player_names = list(Watcher.PLAYER_DICT)
+
+        # 1回目は接続の確立やキャッシュの準備を含むため計測しない
+        Watcher.check_players(player_names)
+        latencies.clear()
+
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(options.sweeps):
+            Watcher.check_players(player_names)
+            # 429/5xx を受けたチェックは「状態を特定できない」になる
+            errors += sum(
+                1 for status in Watcher.player_last_status.values() if status in ('error', 'unknown')
+            )
+        elapsed = time.perf_counter() - start
+
+        # tracemalloc は処理を遅くするため、別のスイープで計測する
+        tracemalloc.start()
+        Watcher.check_players(player_names)
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    results.put({
+        'checks': len(latencies),
+        'elapsed': elapsed,
+        'errors': errors,
+        'latencies': latencies,
+        'traced_peak': traced_peak,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def report(roster_size, workers, result):
+    latencies = result['latencies']
+    checks = result['checks']
+    if not latencies:
+        print(f"{roster_size:>6} {workers:>7}  （チェックなし）")
+        return
+    print(
+        f"{roster_size:>6} {workers:>7} {checks / result['elapsed']:>9.1f}/s"
+        f" {statistics.median(latencies) * 1000:>8.1f} {percentile(latencies, 0.9) * 1000:>8.1f}"
+        f" {percentile(latencies, 0.99) * 1000:>8.1f}"
+        f" {result['errors'] / checks:>6.1%}"
+        f" {result['traced_peak'] / 1024:>9.0f}KB {result['max_rss_kb'] / 1024:>7.1f}MB"
+    )
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log_dir', nargs='?', default='logs')
+    parser.add_argument('--roster', type=parse_ints, default=[10, 50, 200])
+    parser.add_argument('--workers', type=parse_ints, default=[1, 4, 8])
+    parser.add_argument('--sweeps', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='429を返す割合')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='5xxを返す割合')
+    parser.add_argument('--rate-limit', type=float, default=0, help='POROFESSOR_RATE_LIMIT（0で無制限）')
+    parser.add_argument('--serve', action='store_true', help='サーバーのみ起動する')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.log_dir)
+    if not corpus:
+        sys.exit(f"{args.log_dir} に保存済みのHTMLがありません（SAVE_HTML_LOG=true で収集してください）")
+
+    if args.serve:
+        print(f"{len(corpus)} ページを http://127.0.0.1:{args.port or '(自動)'} で配信します")
+        serve(corpus, max(args.roster), args, args.port)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    server = context.Process(
+        target=serve, args=(corpus, max(args.roster), args, args.port, ready), daemon=True
+    )
+    server.start()
+    base_url = f"http://127.0.0.1:{ready.get(timeout=30)}"
+
+    print(
+        f"{len(corpus)} ページ / 遅延 {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms"
+        f" / 429 {args.throttle_rate:.0%} / 5xx {args.error_rate:.0%} / {args.sweeps} スイープ"
+    )
+    print(f"{'名簿':>6} {'ワーカー':>7} {'スループット':>9} {'p50(ms)':>8} {'p90(ms)':>8} {'p99(ms)':>8}"
+          f" {'失敗/不明':>6} {'割当ピーク':>11} {'ピークRSS':>9}")
+    try:
+        for roster_size in args.roster:
+            player_names = [player_name for player_name, _ in build_roster(corpus, roster_size)]
+            for workers in args.workers:
+                results = context.Queue()
+                case = context.Process(target=run_case, args=(base_url, player_names, workers, args, results))
+                case.start()
+                result = results.get()
+                case.join()
+                report(roster_size, workers, result)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
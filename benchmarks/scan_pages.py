@@ -0,0 +1,234 @@
+"""保存済みHTMLログ（save_html_log のアーカイブ、または従来の *.html）を使ったページ解析のベンチマーク
+
+従来の判定関数（デコード + 小文字化 + 複数回のfind）と PageScanner の1ページあたりのCPU時間を比較する。
+どちらも本番と同じく、受信したバイト列から処理を始める。
+
+使い方: python benchmarks/scan_pages.py [ログディレクトリ] [--repeat N] [--chunk-size N]
+"""
+import argparse
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import Watcher  # noqa: E402
+
+CARD_NAME = re.compile(rb'data-summonername="([^"]*)"', re.IGNORECASE)
+
+# 以下は PageScanner に置き換える前の判定・抽出関数（比較対象としてここに残している）
+NOT_IN_GAME_PATTERNS = (
+    'the summoner is not in-game',
+    'summoner-offline',
+    'not in-game',
+    'please retry later',
+    'must be on the loading screen',
+)
+
+
+def check_player_not_found(content, player_name):
+    """プレイヤーが存在しないかチェック"""
+    not_found_patterns = [
+        'Summoner not found',
+        'summoner not found',
+        '404 - page not found',
+        'summoner-not-found',
+        'the summoner does not exist'
+    ]
+    return any(pattern in content for pattern in not_found_patterns)
+
+
+def check_loading_state(content):
+    """ローディング状態をチェック"""
+    loading_patterns = [
+        'damn, that\'s pretty slow to load',
+        'loadmessage',
+        'spinner'
+    ]
+    return any(pattern in content for pattern in loading_patterns)
+
+
+def check_in_game(content):
+    """試合中かチェック"""
+    in_game_patterns = [
+        'live-game-stats',
+        'team stats',
+        'game-status-ingame',
+        'live game',
+        'spectate'
+    ]
+    return any(pattern in content for pattern in in_game_patterns)
+
+
+def extract_match_id(content):
+    """コンテンツからマッチIDを抽出"""
+    match_id = None
+    result_td_start = content.find('class="resulttd"')
+    if result_td_start != -1:
+        href_start = content.find('href="https://www.leagueofgraphs.com/match/', result_td_start)
+        if href_start != -1:
+            href_end = content.find('#', href_start)
+            if href_end != -1:
+                start_pos = href_start + len('href="https://www.leagueofgraphs.com/match/')
+                # /match/{地域}/{マッチID} の地域部分を除く
+                match_id = content[start_pos:href_end].rpartition('/')[2]
+    return match_id
+
+
+def extract_game_type(content):
+    """コンテンツから試合タイプを抽出"""
+    h2_start = content.find('<h2 class="left relative">')
+    if h2_start != -1:
+        h2_end = content.find('</h2>', h2_start)
+        if h2_end != -1:
+            game_type_text = content[h2_start:h2_end].split('\n')[1].strip().lower()
+            type_mapping = {
+                'ranked solo/duo': 'RANKED SOLO/DUO',
+                'ranked flex': 'RANKED FLEX',
+                'normal (quickplay)': 'NORMAL',
+                'aram': 'ARAM',
+                'arena': 'ARENA',
+                'arurf 4v4': 'CUSTOM',
+            }
+            return type_mapping.get(game_type_text, "不明")
+    return "不明"
+
+
+def extract_champion(content, player_name):
+    """コンテンツからチャンピオン名を抽出"""
+    search_name = player_name.lower()
+    card_start = content.find(f'<div class="card card-5" data-summonername="{search_name}"')
+    if card_start == -1:
+        return "不明"
+
+    box_start = content.find('<div class="box championbox', card_start)
+    if box_start == -1:
+        box_start = content.find('class="championbox', card_start)
+        if box_start == -1:
+            return "不明"
+
+    img_flex_start = content.find('<div class="imgflex', box_start)
+    if img_flex_start == -1:
+        return "不明"
+
+    img_column_start = content.find('<div class="imgcolumn-champion', img_flex_start)
+    if img_column_start == -1:
+        return "不明"
+
+    tooltip_start = content.find('<div class="relative requiretooltip', img_column_start)
+    if tooltip_start == -1:
+        return "不明"
+
+    tooltip_class_start = content.find('tooltip="', tooltip_start)
+    if tooltip_class_start == -1:
+        return "不明"
+
+    alt_start = content.find('alt="', tooltip_class_start)
+    if alt_start == -1:
+        return "不明"
+
+    alt_end = content.find('"', alt_start + 5)
+    if alt_end == -1:
+        return "不明"
+
+    return content[alt_start + 5:alt_end].capitalize()
+
+
+def player_from_filename(path):
+    """{プレイヤー名}_{日付}_{時刻}.html からプレイヤー名を復元する"""
+    safe_name = path.stem.rsplit('_', 2)[0]
+    name, _, tag = safe_name.rpartition('-')
+    return f"{name}#{tag}" if name else safe_name
+
+
+def load_pages(log_dir):
+    """(プレイヤー名, ページ) のリスト。アーカイブと従来の *.html の両方を読む"""
+    pages = [
+        (entry['player'], Watcher.HtmlArchive.read(log_dir, entry))
+        for entry in Watcher.HtmlArchive.find(log_dir)
+    ]
+    for path in sorted(Path(log_dir).glob('*.html')):
+        pages.append((player_from_filename(path), path.read_text(encoding='utf-8', errors='replace')))
+    return pages
+
+
+def legacy_pipeline(body, player_names):
+    """check_player_status が以前行っていた判定・抽出の手順（response.text のデコードを含む）"""
+    content = body.decode('utf-8', errors='replace').lower()
+    if check_player_not_found(content, None):
+        return
+    check_loading_state(content)
+    if check_in_game(content):
+        extract_match_id(content)
+        try:
+            extract_game_type(content)
+        except IndexError:
+            pass
+        for player_name in player_names:
+            extract_champion(content, player_name)
+        return
+    any(pattern in content for pattern in NOT_IN_GAME_PATTERNS)
+
+
+def scanner_pipeline(content, chunk_size, player_names, stop_early=False):
+    # stop_early はストリーミング取得と同じく、結果が確定した時点（存在しないと分かった時点）で打ち切る
+    return Watcher.scan_page(content, chunk_size, player_names, stop_early=stop_early)
+
+
+def measure(func, pages, repeat):
+    """ページごとのCPU時間（ミリ秒）のリスト"""
+    timings = []
+    for content, args in pages:
+        start = time.process_time()
+        for _ in range(repeat):
+            func(content, *args)
+        timings.append((time.process_time() - start) / repeat * 1000)
+    return timings
+
+
+def report(label, timings, baseline=None):
+    mean = statistics.mean(timings)
+    p95 = sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else max(timings)
+    line = f"{label:<32} mean {mean:8.3f} ms  median {statistics.median(timings):8.3f} ms  p95 {p95:8.3f} ms"
+    if baseline:
+        line += f"  x{statistics.mean(baseline) / mean:.2f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log_dir', nargs='?', default='logs')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    args = parser.parse_args()
+
+    loaded = load_pages(args.log_dir)
+    if not loaded:
+        sys.exit(f"{args.log_dir} に保存済みのHTMLがありません（SAVE_HTML_LOG=true で収集してください）")
+
+    pages = []
+    for player_name, content in loaded:
+        body = content.encode('utf-8')
+        cards = [card.decode('utf-8', errors='replace').lower() for card in CARD_NAME.findall(body)]
+        pages.append((body, player_name, cards))
+
+    total_bytes = sum(len(content) for content, _, _ in pages)
+    print(f"{len(pages)} ページ / 平均 {total_bytes / len(pages) / 1024:.1f} KB / 繰り返し {args.repeat} 回")
+
+    legacy_one = measure(legacy_pipeline, [(c, ([p],)) for c, p, _ in pages], args.repeat)
+    legacy_all = measure(legacy_pipeline, [(c, (cards,)) for c, _, cards in pages], args.repeat)
+    scan_full = measure(scanner_pipeline, [(c, (None, cards)) for c, _, cards in pages], args.repeat)
+    scan_chunked = measure(scanner_pipeline, [(c, (args.chunk_size, cards)) for c, _, cards in pages], args.repeat)
+    scan_early = measure(scanner_pipeline, [(c, (args.chunk_size, [p], True)) for c, p, _ in pages], args.repeat)
+
+    report('before: 1プレイヤー', legacy_one)
+    report('before: カード上の全プレイヤー', legacy_all)
+    report('after: PageScanner', scan_full, legacy_all)
+    report(f'after: PageScanner ({args.chunk_size}B)', scan_chunked, legacy_all)
+    report('after: PageScanner (早期終了)', scan_early, legacy_one)
+
+
+if __name__ == '__main__':
+    main()